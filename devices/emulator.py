@@ -13,6 +13,7 @@ SCREEN_WIDTH=600
 SCREEN_HEIGHT=800
 WINDOW_NAME = "PSSM Emulator"
 REFRESH_SIMULATION_TIME = 20
+TK_POLL_INTERVAL = 10       # Time in milliseconds between two Tk updates
 
 TK_WINDOW = tk.Tk()
 
@@ -51,9 +52,38 @@ class Screen(generic.Screen):
         self._tklabel.pack()
         # Attach mouseclick event
         self._tklabel.bind("<Button 1>", self._onclick)
+        self.loop = None
+        self._on_quit = None
 
     def _start(self):
         tk.mainloop()
+
+    def _attach_loop(self, loop, on_quit=None):
+        """
+        Makes the screen run on an asyncio event loop: Tk events are processed
+        from a periodic loop callback, and the timers become loop callbacks
+        """
+        self.loop = loop
+        self._on_quit = on_quit
+        self._tk_poll()
+
+    def _detach_loop(self):
+        self.loop = None
+
+    def _tk_poll(self):
+        """
+        Processes the pending Tk events, then schedules the next poll
+        """
+        if self.loop is None:
+            return
+        try:
+            self._tkwindow.update()
+        except tk.TclError:
+            # The window was closed
+            if self._on_quit:
+                self._on_quit()
+            return
+        self.loop.call_later(TK_POLL_INTERVAL/1000, self._tk_poll)
     
     def _stop(self):
         self._tkwindow.destroy()
@@ -74,12 +104,27 @@ class Screen(generic.Screen):
             inverted bool: whether to print the image inverted compared to the
                 screen's inversion status
         """
+        self._paste(img, x, y, inverted)
+        self._update_image(self.image)
+
+    def print_many(self, images):
+        """
+        Takes a list of (img, x, y) tuples and pastes them all on the screen
+        before updating it once
+        """
+        for img, x, y in images:
+            self._paste(img, x, y)
+        self._update_image(self.image)
+
+    def _paste(self, img, x, y, inverted=False):
+        """
+        Pastes the image on the screen image, without updating the window
+        """
         if inverted:
             img = invert(img)
         if self.isInverted:
             img = invert(img)
         self.image.paste(img, (x, y))
-        self._update_image(self.image)
     
     def _update_image(self, img):
         """
@@ -136,6 +181,11 @@ class Screen(generic.Screen):
         """
         Execute the callback function with args after a few milliseconds
         """
+        if self.loop is not None:
+            # Thread-safe, as the timers may be set from worker threads
+            self.loop.call_soon_threadsafe(
+                self.loop.call_later, milliseconds/1000, callback, *args)
+            return
         self._tkwindow.after(milliseconds, callback, *args)
 
 
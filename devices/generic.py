@@ -22,6 +22,16 @@ class Screen:
             y int: the y position
         """
         return NotImplementedError
+
+    def print_many(self, images):
+        """
+        Displays several PIL images at once, with a single refresh
+
+        Parameters:
+            images list: a list of (img, x, y) tuples
+        """
+        for img, x, y in images:
+            self.print(img, x, y)
     
     def clear(self):
         """
@@ -42,6 +52,23 @@ class Screen:
         """
         return NotImplementedError
     
+    def _attach_loop(self, loop, on_quit=None):
+        """
+        Makes the screen run on an asyncio event loop: input events and
+        timers (see after) are handled by loop callbacks
+
+        Parameters:
+            loop : the asyncio event loop
+            on_quit : function to call if the screen gets closed
+        """
+        return NotImplementedError
+
+    def _detach_loop(self):
+        """
+        Stops using the asyncio event loop
+        """
+        return NotImplementedError
+
     def capture(self, full=False):
         """
         Takes a screenshot and returns the corresponding image
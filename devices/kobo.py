@@ -49,7 +49,7 @@ class Screen:
         self.interaction_handler = InputObject(TOUCH_PATH, screen_width,
                                                   screen_height, 
                                                   grabInput=grab_input)
-        pass
+        self.loop = None
 
     def _start(self):
         # TODO : use a thread ?
@@ -64,6 +64,35 @@ class Screen:
                 # we got a click !
                 self.onclick_handler(x, y)
 
+    def _attach_loop(self, loop, on_quit=None):
+        """
+        Makes the screen run on an asyncio event loop: the touch events are
+        read when the input file is readable, and the timers become loop
+        callbacks
+        """
+        self.loop = loop
+        fd = self.interaction_handler.devFile.fileno()
+        loop.add_reader(fd, self._on_input)
+
+    def _detach_loop(self):
+        fd = self.interaction_handler.devFile.fileno()
+        self.loop.remove_reader(fd)
+        self.loop = None
+
+    def _on_input(self):
+        """
+        Called by the event loop when touch events are available
+        """
+        try:
+            touches = self.interaction_handler.readTouches()
+        except Exception:
+            # oops error, continue anyway
+            return
+        for (x, y) in touches:
+            if self.interaction_handler.debounceAllow(x, y):
+                # we got a click !
+                self.onclick_handler(x, y)
+
     def _stop(self):
         self.interaction_handler.close()
     
@@ -72,7 +101,8 @@ class Screen:
         Takes a PIL image and displays it
 
         Parameters:
-            img : a PIL image
+            img : a PIL image. "L" images are sent to FBInk as 8bpp data,
+                "RGBA" ones as 32bpp data
             x int: the x position
             y int: the y position
             inverted bool: whether to print the image inverted compared to the
@@ -99,6 +129,34 @@ class Screen:
             # Then reset to default value
             fbink_cfg.is_nightmode = mode
             fbink_cfg.wfm_mode = initial_waveform
+
+    def print_many(self, images):
+        """
+        Takes a list of (img, x, y) tuples and displays them with a single
+        refresh of the area containing them all
+
+        Parameters:
+            images list: a list of (img, x, y) tuples
+        """
+        # Write everything to the framebuffer first
+        initial_no_refresh = bool(fbink_cfg.no_refresh)
+        fbink_cfg.no_refresh = True
+        for img, x, y in images:
+            raw_data = img.tobytes("raw")
+            FBInk.fbink_print_raw_data(fbfd, raw_data, img.width, img.height,
+                                       len(raw_data), x, y, fbink_cfg)
+        fbink_cfg.no_refresh = initial_no_refresh
+        # Then refresh the area containing all the images, at once
+        x0 = min(x for img, x, y in images)
+        y0 = min(y for img, x, y in images)
+        x1 = max(x + img.width for img, x, y in images)
+        y1 = max(y + img.height for img, x, y in images)
+        FBInk.fbink_refresh(
+            fbfd,
+            y0 + h_offset, x0 + w_offset, x1 - x0, y1 - y0,
+            FBInk.HWD_PASSTHROUGH,
+            fbink_cfg
+        )
     
     def clear(self):
         """
@@ -170,12 +228,21 @@ class Screen:
             full bool: whether to recalculate the image completely, 
                 or simply send back self.image
         """
-        print("SCREEN CAPTURE NOT IMPLEMENTED YET ON THE KOBO")
+        if self.image is None:
+            print("SCREEN CAPTURE NOT IMPLEMENTED YET ON THE KOBO")
+            return None
+        # self.image is the back buffer of the stack, kept up to date on print
+        return self.image.copy()
 
     def after(self, milliseconds, callback, args=[]):
         """
         Execute the callback function with args after a few milliseconds
         """
+        if self.loop is not None:
+            # Thread-safe, as the timers may be set from worker threads
+            self.loop.call_soon_threadsafe(
+                self.loop.call_later, milliseconds/1000, callback, *args)
+            return
         def call_callback():
             sleep(milliseconds/1000)
             callback(*args)
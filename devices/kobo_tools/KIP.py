@@ -63,6 +63,11 @@ class InputObject:
 		self.lastTouchAreaSize = touchAreaSize
 		self.isInputGrabbed = grabInput
 		self.devFile = open(inputPath, "rb")
+		# State of the non-blocking decoder (see readTouches)
+		self.pendingData = b""
+		self.evPacket = []
+		self.badPacket = False
+		self.resetTouch()
 		if grabInput:
 			ioctl(self.devFile, grabber.EVIOCGRAB(1), True)
 
@@ -178,6 +183,83 @@ class InputObject:
 		#print("Results returned")
 		return (rx, ry, None)
 
+	def resetTouch(self):
+		""" Forgets the touch being decoded by readTouches """
+		self.touchX = -1
+		self.touchY = -1
+		self.touchPressed = False
+		self.touchReleased = False
+
+	def readTouches(self):
+		"""
+		Non-blocking counterpart of getInput, to be called when the input file
+		is readable (from an event loop reader for instance).
+		Reads the available events only, and keeps the partially received
+		packets for the next call.
+		Returns the list of the rotated (x, y) coordinates of the touches
+		completed by these events
+		"""
+		touches = []
+		data = self.pendingData + os.read(self.devFile.fileno(), EVENT_SIZE*64)
+		complete = len(data) - len(data) % EVENT_SIZE
+		self.pendingData = data[complete:]
+		for offset in range(0, complete, EVENT_SIZE):
+			inp = struct.unpack_from(FORMAT, data, offset)
+			(TimeSec,TimeUsec,EvType,EvCode,EvValue) = inp
+			if EvType == evSyn and EvCode == synDropped:
+				# we need to ignore all packets up to, and including the next
+				# SYN_REPORT
+				self.badPacket = True
+				self.evPacket = []
+				continue
+			if self.badPacket:
+				if EvType == evSyn and EvCode == synReport:
+					print("Error : bad event packet")
+					self.badPacket = False
+					self.resetTouch()
+				continue
+			self.evPacket.append(inp)
+			if EvType == evSyn and EvCode == synReport:
+				# We have a complete event packet
+				touch = self.decodePacket(self.evPacket)
+				self.evPacket = []
+				if touch:
+					touches.append(touch)
+		return touches
+
+	def decodePacket(self, evPacket):
+		"""
+		Decodes a packet into the touch being read.
+		Returns the rotated (x, y) coordinates if the touch is complete,
+		else None
+		"""
+		for e in evPacket:
+			if e[2] == evKey:
+				if e[3] == btnTouch:
+					if e[4] == 1:
+						self.touchPressed = True
+					else :
+						self.touchReleased = True
+			elif e[2] == evAbs:
+				if e[3] == absX or e[3] == absMTposX:
+					self.touchX = int(e[4])
+				elif e[3] == absY or e[3] == absMTposY:
+					self.touchY = int(e[4])
+				elif e[3] == absMTPressure or e[3] == absMTtouchWidthMajor:
+					if e[4] > 0:
+						self.touchPressed = True
+					else:
+						self.touchReleased = True
+		if not self.touchReleased:
+			return None
+		x, y = self.touchX, self.touchY
+		isComplete = x >= 0 and y >= 0 and self.touchPressed
+		self.resetTouch()
+		if not isComplete:
+			return None
+		# Same rotation as getInput
+		return (self.viewWidth - y + 1, x)
+
 	def debounceAllow(self,x,y):
 		"""
 		Returns False if the two last clicks were too close in time and in the same area.
@@ -0,0 +1,79 @@
+import ast
+from functools import lru_cache
+
+QUESTION_MARK = "qm"        # Name given to "?" in the compiled expressions
+VARIABLES = ("W", "H", "w", "h", "p", "P", QUESTION_MARK)
+FUNCTIONS = {
+    'min': min,
+    'max': max,
+    'abs': abs,
+    'int': int,
+    'round': round
+}
+ALLOWED_NODES = (
+    ast.Expression, ast.Constant, ast.Name, ast.Load, ast.Call,
+    ast.BinOp, ast.Add, ast.Sub, ast.Mult, ast.Div, ast.FloorDiv, ast.Mod,
+    ast.UnaryOp, ast.UAdd, ast.USub
+)
+
+
+class Dimension():
+    """
+    A dimension expression (like "H*0.1" or "?*2"), parsed and compiled once.
+
+    Only numbers, arithmetic operators (except **, which could take forever
+    to evaluate), the variables W, H (screen width and height), w, h (element
+    width and height), p or P (one pixel), ? (the share of the remaining
+    space) and the functions min, max, abs, int and round are allowed:
+    nothing else can be evaluated.
+
+    Args:
+        source str: the dimension, as given by the user
+    """
+    def __init__(self, source):
+        self.source = source
+        expression = source.replace("?", QUESTION_MARK)
+        try:
+            tree = ast.parse(expression.strip(), mode="eval")
+        except SyntaxError:
+            raise ValueError("[PSSM] Could not parse dimension : {}".format(source))
+        names = set()
+        for node in ast.walk(tree):
+            if not isinstance(node, ALLOWED_NODES):
+                raise ValueError("[PSSM] Forbidden syntax in dimension : {}".format(source))
+            if isinstance(node, ast.Name):
+                if node.id not in VARIABLES and node.id not in FUNCTIONS:
+                    raise ValueError("[PSSM] Unknown name in dimension : {}".format(source))
+                names.add(node.id)
+            elif isinstance(node, ast.Call) and not isinstance(node.func, ast.Name):
+                raise ValueError("[PSSM] Forbidden syntax in dimension : {}".format(source))
+            elif isinstance(node, ast.Constant) and not isinstance(node.value, (int, float)):
+                raise ValueError("[PSSM] Forbidden constant in dimension : {}".format(source))
+        self.has_qm = QUESTION_MARK in names
+        # The expression becomes the body of a function of the variables, so
+        # that evaluating it is a plain function call
+        code = "lambda {}: {}".format(", ".join(VARIABLES), expression.strip())
+        namespace = {'__builtins__': {}, **FUNCTIONS}
+        self.function = eval(compile(code, "<dimension>", "eval"), namespace)
+
+    def __repr__(self):
+        return "Dimension({!r})".format(self.source)
+
+    def evaluate(self, W, H, w, h, qm=1):
+        """
+        Returns the value of the dimension (not rounded)
+
+        Args:
+            W, H int: the screen width and height
+            w, h int: the element width and height
+            qm: the value of "?"
+        """
+        return self.function(W, H, w, h, 1, 1, qm)
+
+
+@lru_cache(maxsize=1024)
+def parse_dimension(source):
+    """
+    Returns the compiled Dimension of the given string, cached by source
+    """
+    return Dimension(source)
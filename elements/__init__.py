@@ -2,4 +2,5 @@ from .element import Element
 from .demo import Demo
 from .static import Static
 from .rectangle import Rectangle
-from .margin import Margin
\ No newline at end of file
+from .margin import Margin
+from .tiled import TiledImage
\ No newline at end of file
@@ -1,13 +1,15 @@
-from PIL import Image
 from .element import Element
 
 
 class Demo(Element):
+    __slots__ = ()
+    fingerprint_attrs = ()
+
     def __init__(self):
         super().__init__()
         self.area = [(0,0), (100, 200)]
     
     def generator_img(self):
         color = (255, 120, 0, 255)
-        img = Image.new('RGBA', self.area[1], color=color)
+        img = self.new_image(self.area[1], color)
         self.image = img
\ No newline at end of file
@@ -1,28 +1,65 @@
-from PIL import ImageDraw, ImageFont
+from itertools import count
+from PIL import Image, ImageDraw
 from ..styles import DEFAULT as DEFAULT_STYLE
+from ..utils import convert_color, get_font, get_text_size
+from ..utils import LRUCache, image_nbytes, freeze, has_identity_key
+from ..dimension import Dimension, parse_dimension
 
-last_used_id = 0
+element_ids = count()   # Thread-safe: elements can be created by render threads
 LOAD_STYLE = "Load style from stack"
+IMAGE_CACHE_SIZE = 8 * 1024 * 1024      # In bytes
+SIZE_ATTRS = ('width', 'height', 'area')  # Changing them requires a relayout
+
+# Images shared by the elements which have the same fingerprint
+image_cache = LRUCache(IMAGE_CACHE_SIZE, sizeof=image_nbytes)
+
+
+def is_defined(arg):
+    """
+    Returns True if the style argument is set (not waiting to be loaded)
+    """
+    return arg is not None and arg != LOAD_STYLE
+
 
 class Element():
+    # The attributes of the elements are declared in __slots__, which is much
+    # lighter than a __dict__ per instance. Any other attribute (like the
+    # user's data) goes to a __dict__, which is only created when one is set.
+    # Subclasses should declare their own attributes in __slots__.
+    __slots__ = ('__dict__', 'id', 'image', 'area', 'is_layout',
+                 'is_inverted', 'is_generated', 'needs_layout', 'fingerprint',
+                 'width',
+                 'height', 'style', 'style_table', 'onclick', 'onclick_invert',
+                 'onclick_invert_duration', 'parent', 'parent_stack',
+                 'text', 'text_font', 'text_color', 'text_size', 'text_x',
+                 'text_y')
+
+    # The attributes (besides the area, the text and the styles) the image of
+    # the element depends on. Elements which can be fingerprinted skip their
+    # generation when nothing changed and share their images with identical
+    # elements. None means the element cannot be fingerprinted: subclasses
+    # whose image depends on something else than attributes must keep it.
+    fingerprint_attrs = None
+
     def __init__(self, **kwargs):
-        global last_used_id
-        self.id = last_used_id
-        last_used_id += 1
+        self.id = next(element_ids)
         self.image = None
         self.area = [(None,None), ("?", "?")]        # Shape [(x, y), (w, h)]
         self.is_layout = False
         self.is_inverted = None
         self.is_generated = False
+        self.needs_layout = False   # Only used by layouts
+        self.fingerprint = None
         self.width = None
         self.height = None
         self.style = {}
+        self.style_table = None     # Shape (stack, style version, style, table)
         # Events on click
         self.onclick = None
         self.onclick_invert = False
         self.onclick_invert_duration = 80   # Time in milliseconds
         # Useful stuff
-        self.parent_layouts = []
+        self.parent = None          # The layout it belongs to, if any
         self.parent_stack = None
         # Text data
         self.add_text("")   # Initialize with default values
@@ -47,12 +84,74 @@ class Element():
         self._convert_area()
         if not skip_styles:
             self._parse_styles()
+        fingerprint = self._fingerprint()
+        # A fingerprint holding an object (like a PIL image given as input)
+        # would keep it alive in the shared cache, which only counts the
+        # size of the generated image
+        is_shared = fingerprint is not None and \
+                    not has_identity_key(fingerprint)
+        if fingerprint is not None and fingerprint == self.fingerprint and \
+                self.image is not None:
+            # Nothing changed
+            return self.image
+        if is_shared:
+            cached_image = image_cache.get(fingerprint)
+            if cached_image is not None:
+                # An identical element was already generated
+                self.image = cached_image
+                self.fingerprint = fingerprint
+                self.is_generated = True
+                return self.image
         self.generator_img()
         if self.text:
             self.generator_text()
+        if is_shared and self.image is not None:
+            image_cache.put(fingerprint, self.image)
+        self.fingerprint = fingerprint
         self.is_generated = True
         return self.image
+
+    def _fingerprint(self):
+        """
+        Returns a hashable summary of everything the image depends on (the
+        element type, the size, the text, the styles, and the attributes
+        listed in fingerprint_attrs), or None if it cannot be fingerprinted
+        """
+        if self.fingerprint_attrs is None:
+            return None
+        elt_type = self.__class__.__name__
+        inputs = [elt_type, self.get_mode(), self.area[1], self.text]
+        inputs += [getattr(self, arg) for arg in DEFAULT_STYLE.get(elt_type, ())]
+        inputs += [getattr(self, arg) for arg in self.fingerprint_attrs]
+        return freeze(inputs)
     
+    def get_mode(self):
+        """
+        Returns the image mode of the pipeline ("RGBA" or "L")
+        """
+        if self.parent_stack is None:
+            return "RGBA"
+        return self.parent_stack.mode
+
+    def new_image(self, size, color=None):
+        """
+        Returns a new PIL image in the mode of the pipeline, filled with the
+        given RGBA color (converted to the mode)
+        """
+        mode = self.get_mode()
+        return Image.new(mode, size, color=convert_color(color, mode))
+
+    def is_opaque(self):
+        """
+        Returns True if the element hides whatever is below it, over its whole
+        area. The stack pastes the images without any mask (transparent pixels
+        replace the ones below), so it is the case of any generated image
+        which covers the area.
+        """
+        if self.image is None or not self.is_generated:
+            return False
+        return self.image.size == tuple(self.area[1])
+
     def generator_img(self):
         """
         Creates the image. Each subclass will have to implement this function.
@@ -70,8 +169,8 @@ class Element():
         # Load image
         draw = ImageDraw.Draw(self.image)
         # Load font
-        font = ImageFont.truetype(self.text_font, size)
-        text_w, text_h = draw.textsize(self.text, font=font)
+        font = get_font(self.text_font, size)
+        text_w, text_h = get_text_size(font, self.text)
         # Find x position
         if isinstance(x, str):
             x.lower()
@@ -99,13 +198,16 @@ class Element():
             if not isinstance(y, int):
                 raise ValueError("Invalid text position : {}".format(self.text_y))
         # Draw text
-        draw.text((x, y), self.text, fill=self.text_color, font=font)
+        fill = convert_color(self.text_color, self.get_mode())
+        draw.text((x, y), self.text, fill=fill, font=font)
         return self.image
 
     def update(self, attr={}, skip_gen=False, skip_print=False, on_top=False):
         """
         Pass a dict as argument, and it will update the Element's attributes
         accordingly (both its attribute and then the screen).
+        Only the element is regenerated and pasted back in its parent layouts,
+        unless its size changes: then the layouts are laid out again.
 
         Arguments:
             attr dict: the dictionnary of attributes to set
@@ -114,27 +216,109 @@ class Element():
             on_top bool: whether to force print it on top of the stack, 
                 whatever the actual stack position (can be much faster).
         """
+        # What is displayed, before anything changes
+        was_generated = self.is_generated
+        previous_fingerprint = self.fingerprint
+        previous_area = self.area
         # First, we set the attributes
         for param in attr:
             setattr(self, param, attr[param])
-        if not skip_gen:
+            if param in SIZE_ATTRS:
+                self._mark_layout_dirty()
+        if self.parent_stack is not None and self.parent_stack.batch_depth > 0:
+            # The stack will generate and print it at the end of the batch
+            if not skip_gen:
+                displayed = (previous_fingerprint, previous_area) \
+                            if was_generated else None
+                self.parent_stack._defer_update(self, not skip_print,
+                                                displayed)
+            return True
+        if skip_gen:
+            # No need to update if no regen
+            return True
+        root = self._get_root_layout()
+        is_relayout = root is not None and root.needs_layout
+        if is_relayout:
+            # Its size changed, the whole layout has to be done again (which
+            # regenerates this element)
+            root.generator()
+            damaged_area = root.area
+        else:
             # we recreate the pillow image of this particular object
             self.generator()
-        if (not skip_print) and (not skip_gen):  # No need to update if no regen
-            if on_top:
+            damaged_area = self.area
+        # Its area may have changed
+        self.parent_stack._reindex(self)
+        is_unchanged = self.fingerprint is not None and \
+                       self.fingerprint == previous_fingerprint and \
+                       self.area == previous_area
+        if was_generated and is_unchanged:
+            # Same image as the one displayed: no need to print it
+            return True
+        if not is_relayout:
+            self._refresh_parents()
+        if not skip_print:
+            is_moved = was_generated and self.area != previous_area
+            if is_moved:
+                # What was displayed at its previous area has to be cleaned
+                self.parent_stack.print_stack(areas=[previous_area,
+                                                     damaged_area])
+            elif on_top and not is_relayout:
                 self.parent_stack._print_elt(self)
             else:
-                hasParent = len(self.parent_layouts) > 0
-                # We don't want unncesseray generation when printing batch
-                if hasParent:
-                    # We recreate the pillow image of the oldest parent
-                    # And it is not needed to regenerate standard objects, since
-                    oldest_parent = self.parent_layouts[0]
-                    oldest_parent.generator(layout_only=True)
                 # Then, let's reprint the stack
-                self.parent_stack.print_stack(area=self.area)
+                self.parent_stack.print_stack(area=damaged_area)
         return True
-    
+
+    @property
+    def parent_layouts(self):
+        """
+        The parent layouts, from the oldest one to the closest one (walks up
+        the parent pointers, nothing is stored)
+        """
+        parents = []
+        parent = self.parent
+        while parent is not None:
+            parents.append(parent)
+            parent = parent.parent
+        parents.reverse()
+        return parents
+
+    def _get_root_layout(self):
+        """
+        Returns the oldest parent layout, or None
+        """
+        if self.parent is None:
+            return None
+        root = self.parent
+        while root.parent is not None:
+            root = root.parent
+        return root
+
+    def _mark_layout_dirty(self):
+        """
+        Flags this element (if it is a layout) and all its parent layouts as
+        needing to be laid out again
+        """
+        self.needs_layout = self.is_layout
+        for parent in self.parent_layouts:
+            parent.needs_layout = True
+
+    def _refresh_parents(self):
+        """
+        Pastes the new image of this element in the images of its parent
+        layouts, instead of compositing them again. The parents pasted their
+        children without any mask, so this gives the exact same result.
+        """
+        if self.image is None:
+            return
+        (x, y) = self.area[0]
+        for parent in self.parent_layouts:
+            if parent.image is None or parent.needs_layout:
+                continue
+            (parent_x, parent_y) = parent.area[0]
+            parent.image.paste(self.image, (x - parent_x, y - parent_y))
+
     def _convert_area(self):
         [(x,y), (w,h)] = self.area
         x = self._convert_dimension(x)
@@ -144,12 +328,12 @@ class Element():
         self.area = [(x,y), (w,h)]
         return True
 
-    def _convert_dimension(self, dimension):
+    def _convert_dimension(self, dimension, qm=None):
         """
         Converts the user dimension input (like "h*0.1") to to proper integer
         amount of pixels.
-        Basically, you give it a string. And it will change a few characters to
-        their corresponding value, then return the evaluated string.
+        Basically, you give it a string. It is compiled once (see
+        PSSM.dimension), then evaluated with the screen and element sizes.
 
         Examples:
             I HIGHLY recommend doing only simple operation, like "H*0.1", or
@@ -160,40 +344,29 @@ class Element():
             elt.convertDimension("p*300+max(w, h)")
                     -> 300 + max(element_width, screen_height)
 
-        Note:
-            When using question mark dimension (like "?*2"), the question mark
-            MUST be at the beginning of the string
+        Args:
+            dimension int or str: the dimension
+            qm: the value of the question mark. If None, question mark
+                dimensions (like "?*2") are returned as Dimension objects,
+                to be evaluated by the layout once it knows the remaining space.
         """
         if isinstance(dimension, int):
             return dimension
         elif isinstance(dimension, str):
-            # INIT
-            W = self.parent_stack.screen.width
-            H = self.parent_stack.screen.height
-            if self.area:
-                w, h = self.area[1]
-            else:
-                # area not defined. Instead of being stuck, let's assume the
-                # screen height and width are a decent alternative
-                w, h = W, H
-            replace_dict = {
-                'p' : '1',
-                'P' : '1',
-                'W' : str(W),
-                'H' : str(H),
-                'w' : str(w),
-                'h' : str(h)
-            }
-            # We replace every 'w' or 'h' with their corresponding value
-            for key in replace_dict.keys():
-                dimension = dimension.replace(key, replace_dict[key])
-            if "?" in dimension:
-                return dimension
-            else:
-                return int((eval(dimension)))
-        else:
+            dimension = parse_dimension(dimension)
+        elif not isinstance(dimension, Dimension):
             message = "[PSSM] Could not parse dimension : {}".format(dimension)
-            raise TypeError(message)    
+            raise TypeError(message)
+        if dimension.has_qm and qm is None:
+            return dimension
+        W = self.parent_stack.screen.width
+        H = self.parent_stack.screen.height
+        w, h = self.area[1] if self.area else (None, None)
+        if not isinstance(w, int) or not isinstance(h, int):
+            # area not defined. Instead of being stuck, let's assume the
+            # screen height and width are a decent alternative
+            w, h = W, H
+        return int(dimension.evaluate(W, H, w, h, qm))
 
     def add_text(self, text, font=LOAD_STYLE, color=LOAD_STYLE,
                  size=LOAD_STYLE, x=LOAD_STYLE, y=LOAD_STYLE):
@@ -219,37 +392,63 @@ class Element():
             list_styles list: list of styles to parse (if empty, will 
                               parse them all)
         """
+        table = self._get_style_table()
+        if len(list_styles)>0:
+            where_from = list_styles
+        else:
+            where_from = table
 
-        def is_defined(arg):
-            return arg is not None and arg != LOAD_STYLE
-        
-        parent_style = self.parent_stack.style
+        # then loop through the possible styles and set the undefined ones
+        for arg in where_from:
+            if not is_defined(getattr(self, arg, None)):
+                setattr(self, arg, table[arg])
 
-        # Avoid errors if i forgot to add the default style
+    def _get_style_table(self):
+        """
+        Returns the flat {style: value} table of the element, as resolved from
+        self.style, then the stack style, then the default one from pssm.
+        The elements without a style of their own share the table of their
+        type, kept by the stack. The other ones keep their own table, until
+        self.style is assigned or the stack style changes (see
+        Stack.set_style).
+        """
+        stack = self.parent_stack
         elt_type = self.__class__.__name__
+        if not self.style:
+            table = stack.style_tables.get(elt_type)
+            if table is None:
+                table = self._resolve_style_table()
+                stack.style_tables[elt_type] = table
+            return table
+        cached = self.style_table
+        if cached is not None and cached[0] is stack and \
+                cached[1] == stack.style_version and cached[2] is self.style:
+            return cached[3]
+        table = self._resolve_style_table()
+        self.style_table = (stack, stack.style_version, self.style, table)
+        return table
 
+    def _resolve_style_table(self):
+        """
+        Resolves the style table of the element (see _get_style_table)
+        """
+        parent_style = self.parent_stack.style
+        elt_type = self.__class__.__name__
+        # Avoid errors if i forgot to add the default style
         if not elt_type in DEFAULT_STYLE:
             mes = "[PSSM Internal eror] No default style defined\
                    for {}".format(elt_type)
             raise NameError(mes)
 
-        if len(list_styles)>0:
-            where_from = list_styles
-        else:
-            where_from = DEFAULT_STYLE[elt_type]
-    
-        # then loop through the possible styles and parse them
-        for arg in where_from:
-            set_style = getattr(self, arg)
-            if not is_defined(set_style):
-                if arg in self.style and is_defined(self.style[arg]):
-                    # We set it using self.style if possible
-                    setattr(self, arg, self.style[arg])
-                elif elt_type in parent_style and arg in parent_style[elt_type]:
-                    # else, we set it with the stack style
-                    elementstyle = parent_style[elt_type]
-                    setattr(self, arg, elementstyle[arg])
-                else:
-                    # else, we rollback to the default one from pssm
-                    setattr(self, arg, DEFAULT_STYLE[elt_type][arg])
-        
\ No newline at end of file
+        table = {}
+        for arg in DEFAULT_STYLE[elt_type]:
+            if arg in self.style and is_defined(self.style[arg]):
+                # We set it using self.style if possible
+                table[arg] = self.style[arg]
+            elif elt_type in parent_style and arg in parent_style[elt_type]:
+                # else, we set it with the stack style
+                table[arg] = parent_style[elt_type][arg]
+            else:
+                # else, we rollback to the default one from pssm
+                table[arg] = DEFAULT_STYLE[elt_type][arg]
+        return table
@@ -7,6 +7,8 @@ class Margin(Element):
     """
     A margin (transparent)
     """
+    __slots__ = ()
+
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
     
@@ -1,8 +1,14 @@
-from PIL import Image, ImageDraw
+from PIL import ImageDraw
 from .element import Element
+from ..utils import convert_color, LRUCache, image_nbytes, freeze
 
 
 LOAD_STYLE = "Load style from stack"
+TEMPLATE_CACHE_SIZE = 2 * 1024 * 1024   # In bytes
+
+# The frames (background and sides, without the text) already drawn, shared
+# by all the rectangles which look the same
+templates = LRUCache(TEMPLATE_CACHE_SIZE, sizeof=image_nbytes)
 
 class Rectangle(Element):
     """
@@ -13,6 +19,8 @@ class Rectangle(Element):
         sides_color tuple or dict: The border color. If dict, then it should look like {'t':(255,255,255,250)}
         sides_width int or dict: border width in pixels. If dict, then it looks like : {'t':1, 'l':2}
     """
+    __slots__ = ('sides', 'background_color', 'sides_color', 'sides_width')
+    fingerprint_attrs = ()
     def __init__(self, sides=LOAD_STYLE, background_color=LOAD_STYLE, 
                  sides_color=LOAD_STYLE, sides_width=LOAD_STYLE, **kwargs):
         super().__init__(**kwargs)
@@ -23,8 +31,23 @@ class Rectangle(Element):
     
     def generator_img(self):
         w, h = self.area[1]
-        img = Image.new("RGBA", (w, h), color=self.background_color)
-        draw = ImageDraw.Draw(img, "RGBA")
+        mode = self.get_mode()
+        key = (w, h, mode, freeze(self.background_color), self.sides,
+               freeze(self.sides_color), freeze(self.sides_width))
+        template = templates.get(key)
+        if template is None:
+            template = self._draw_template(w, h, mode)
+            templates.put(key, template)
+        # The template is shared: the text has to be drawn on a copy of it
+        self.image = template.copy() if self.text else template
+        return self.image
+
+    def _draw_template(self, w, h, mode):
+        """
+        Draws the background and the sides
+        """
+        img = self.new_image((w, h), self.background_color)
+        draw = ImageDraw.Draw(img, "RGBA" if mode == "RGBA" else None)
         # Get the colors of the sides
         if isinstance(self.sides_color, dict):
             default = (255,255,255,255)
@@ -34,6 +57,7 @@ class Rectangle(Element):
             c_b = self.sides_color['b'] if 'b' in self.sides_color else default
         else:
             c_t = c_l = c_r = c_b = self.sides_color
+        c_t, c_l, c_r, c_b = [convert_color(c, mode) for c in (c_t, c_l, c_r, c_b)]
         # Get the width of the sides
         if isinstance(self.sides_width, int):
             off = self.sides_width // 2 - 1       
@@ -60,5 +84,4 @@ class Rectangle(Element):
         if "b" in self.sides:
             side = [(0, h-off_b-2), (w, h-off_b-2)]
             draw.line(side, fill=c_b, width=w_b)
-        self.image = img
-        return self.image
\ No newline at end of file
+        return img
\ No newline at end of file
@@ -1,5 +1,27 @@
+import os
 from PIL import Image
 from .element import Element
+from ..utils import convert_color, convert_image, LRUCache, image_nbytes, freeze
+
+DECODE_CACHE_SIZE = 16 * 1024 * 1024    # In bytes
+REDUCE_MODES = ("L", "LA", "RGB", "RGBA", "RGBX", "CMYK", "I", "F")
+
+# The images already decoded and fitted to their area, so that identical
+# Static elements (and regenerations) do not touch the disk again
+decoded_images = LRUCache(DECODE_CACHE_SIZE, sizeof=image_nbytes)
+
+
+def get_mtime(image_input):
+    """
+    Returns the modification time of the file, or None if the image is not
+    given as a path (or the file cannot be found)
+    """
+    if not isinstance(image_input, str):
+        return None
+    try:
+        return os.stat(image_input).st_mtime_ns
+    except OSError:
+        return None
 
 
 class Static(Element):
@@ -13,7 +35,12 @@ class Static(Element):
         rotation int: an integer rotation angle
         background_color : an RGBA background color
     """
-    def __init__(self, image, centered=False, resize=True, 
+    __slots__ = ('image_input', 'resize', 'centered', 'rotation',
+                 'background_color')
+    fingerprint_attrs = ('image_input', 'resize', 'centered', 'rotation',
+                         'background_color')
+
+    def __init__(self, image, centered=False, resize=True,
                  rotation=0, background_color=(0, 0, 0, 0), **kwargs):
         super().__init__(**kwargs)
         self.image_input = image
@@ -21,19 +48,44 @@ class Static(Element):
         self.centered = centered
         self.rotation = rotation
         self.background_color = background_color
-    
+
+    def _fingerprint(self):
+        """
+        Same as the Element's, plus the modification time of the file: an
+        image edited on disk is decoded again
+        """
+        fingerprint = super()._fingerprint()
+        return (fingerprint, get_mtime(self.image_input))
+
     def generator_img(self, area=None):
         if area:
             self.area = area
         (x, y), (w, h) = self.area
+        mode = self.get_mode()
+        key = None
         if isinstance(self.image_input, str):
-            pil_img = Image.open(self.image_input)
+            key = (self.image_input, get_mtime(self.image_input), (w, h),
+                   self.rotation, self.resize, self.centered,
+                   freeze(self.background_color), mode)
+            pil_img = decoded_images.get(key)
+            if pil_img is not None:
+                # The text (if any) must not be drawn on the cached image
+                self.image = pil_img.copy() if self.text else pil_img
+                return self.image
+            pil_img = self._open(self.image_input, w, h)
         else:
             pil_img = self.image_input
+        pil_img = convert_image(pil_img, mode)
+        if self.resize and w > 0 and h > 0 and pil_img.mode in REDUCE_MODES:
+            # Shrink it by an integer factor first (much cheaper than the
+            # resampling of the full image), keeping it larger than the area
+            factor = int(min(pil_img.width/w, pil_img.height/h))
+            if factor >= 2:
+                pil_img = pil_img.reduce(factor)
         # Rotate if required
         if self.rotation != 0:
             pil_img = pil_img.rotate(self.rotation,
-                                         fillcolor=self.background_color)
+                                     fillcolor=convert_color(self.background_color, mode))
         # Resize if required
         if self.resize:
             r = min(w/pil_img.width, h/pil_img.height)
@@ -41,12 +93,29 @@ class Static(Element):
             pil_img = pil_img.resize(size)
         # Center if required
         if self.centered:
-            img = Image.new("RGBA", (w, h), color=self.background_color)
+            img = self.new_image((w, h), self.background_color)
             x = int(0.5*w-0.5*pil_img.width)
             y = int(0.5*h-0.5*pil_img.height)
             img.paste(pil_img, (x, y))
             pil_img = img
         # Then return
         self.image = pil_img.crop((0, 0, w, h))
+        if key is not None:
+            decoded_images.put(key, self.image)
+            if self.text:
+                self.image = self.image.copy()
+        return pil_img
+
+    def _open(self, path, w, h):
+        """
+        Opens the image file. When it is only going to be shrunk to fit the
+        area, JPEG files are decoded at a reduced scale (1/2, 1/4 or 1/8,
+        never smaller than the area)
+        """
+        pil_img = Image.open(path)
+        if self.resize and w > 0 and h > 0:
+            r = min(w/pil_img.width, h/pil_img.height)
+            if r < 1:
+                target = (int(pil_img.width*r), int(pil_img.height*r))
+                pil_img.draft(pil_img.mode, target)
         return pil_img
-        
\ No newline at end of file
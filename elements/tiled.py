@@ -0,0 +1,268 @@
+import mmap
+from math import ceil, floor
+from PIL import Image
+from .element import Element
+from ..utils import convert_image, LRUCache, image_nbytes, freeze
+
+TILE_SIZE = 256                         # In pixels
+TILE_CACHE_SIZE = 16 * 1024 * 1024      # In bytes
+REDUCING_GAP = 2.0                      # See PIL.Image.resize
+# The modes Pillow maps without copying them (see PIL.Image.frombuffer)
+MAPPED_MODES = ("L", "P", "RGBX", "RGBA", "CMYK", "I;16", "I;16L", "I;16B")
+
+# The rendered tiles of every TiledImage, shape {(elt id, source version,
+# mode, scale, tile size, background, tx, ty): tile}
+tiles = LRUCache(TILE_CACHE_SIZE, sizeof=image_nbytes)
+
+
+class TiledImage(Element):
+    """
+    Displays a part of an image which can be much larger than the screen (or
+    than the memory, when fully decoded), like a map or a scanned document.
+
+    The view is made of square tiles, which are only rendered when they
+    become visible and are then kept in a bounded cache: panning or zooming
+    back only renders the tiles which were never seen.
+
+    Only raw files and uncompressed formats stay bounded in memory: raw files
+    are memory mapped (in any mode with whole bytes per pixel, like "L",
+    "RGB" or "RGBA"), and uncompressed formats (BMP, uncompressed TIFF,
+    PPM...) are memory mapped by Pillow itself, so only the pages of the
+    cropped regions are read. Compressed formats are fully decoded the first
+    time a tile is rendered (JPEG files at a reduced scale, 1/2 to 1/8, when
+    zoomed out). Files opened by Pillow are subject to its
+    Image.MAX_IMAGE_PIXELS limit (DecompressionBombError).
+
+    Arguments:
+        image str or PIL Image: Path to the image (or raw file), or PIL image
+        scale float: The zoom level (1 means one pixel of the source per
+            pixel of the screen)
+        position tuple: The coordinates, in the zoomed image, of the top left
+            corner of the view
+        raw_size tuple: If the file is raw pixel data, its (width, height)
+        raw_mode str: The PIL mode of the raw pixel data (like "L" or "RGB")
+        tile_size int: The width and height of a tile, in pixels
+        background_color : an RGBA color, for what is outside of the image
+    """
+    __slots__ = ('image_input', 'source', 'source_key', 'source_version',
+                 'mapping', 'pixel_bytes', 'draft_source', 'scale', 'position',
+                 'raw_size', 'raw_mode', 'tile_size', 'background_color')
+
+    def __init__(self, image, scale=1, position=(0, 0), raw_size=None,
+                 raw_mode="L", tile_size=TILE_SIZE,
+                 background_color=(255, 255, 255, 255), **kwargs):
+        super().__init__(**kwargs)
+        self.image_input = image
+        self.source = None      # Opened on first use
+        self.source_key = None  # What the source was opened from
+        self.source_version = 0 # Bumped each time it is opened
+        self.mapping = None
+        self.pixel_bytes = None # For raw files mapped as bytes, per pixel
+        self.draft_source = None    # Shape (requested size, JPEG at reduced scale)
+        self.scale = scale
+        self.position = position
+        self.raw_size = raw_size
+        self.raw_mode = raw_mode
+        self.tile_size = tile_size
+        self.background_color = background_color
+
+    def generator_img(self):
+        w, h = self.area[1]
+        self.position = self._clamp_position(self.position, self.scale)
+        (view_x, view_y) = self.position
+        size = self.tile_size
+        img = self.new_image((w, h), self.background_color)
+        for ty in range(view_y // size, (view_y+h-1) // size + 1):
+            for tx in range(view_x // size, (view_x+w-1) // size + 1):
+                img.paste(self._get_tile(tx, ty), (tx*size - view_x,
+                                                   ty*size - view_y))
+        self.image = img
+        return self.image
+
+    def pan(self, dx, dy, skip_print=False):
+        """
+        Moves the view by the given number of pixels (of the screen). Only
+        the tiles which become visible are rendered.
+        """
+        (x, y) = self.position
+        position = self._clamp_position((x+dx, y+dy), self.scale)
+        return self.update({'position': position}, skip_print=skip_print)
+
+    def zoom(self, factor, center=None, skip_print=False):
+        """
+        Multiplies the zoom level by the given factor, keeping the given point
+        (relative to the element, defaults to the center of the view) still.
+        The tiles of a zoom level already seen are reused.
+        """
+        w, h = self.area[1]
+        if center is None:
+            center = (w // 2, h // 2)
+        (center_x, center_y) = center
+        (x, y) = self.position
+        # Rounded, so that zooming back finds the tiles of the previous level
+        scale = round(self.scale * factor, 6)
+        position = (round((x+center_x) * factor - center_x),
+                    round((y+center_y) * factor - center_y))
+        position = self._clamp_position(position, scale)
+        return self.update({'scale': scale, 'position': position},
+                           skip_print=skip_print)
+
+    def close(self):
+        """
+        Releases the source (and unmaps the raw file)
+        """
+        self.source = None
+        self.source_key = None
+        self.pixel_bytes = None
+        self.draft_source = None
+        if self.mapping is not None:
+            self.mapping.close()
+            self.mapping = None
+
+    def _get_source(self):
+        """
+        Returns the source image, opening it (lazily) on first use, or again
+        when the image input changed
+        """
+        source_key = self._get_source_key()
+        if self.source is not None and source_key == self.source_key:
+            return self.source
+        self.close()
+        self.source_key = source_key
+        self.source_version += 1
+        if not isinstance(self.image_input, str):
+            self.source = self.image_input
+        elif self.raw_size is not None:
+            pixel_bytes = len(Image.new(self.raw_mode, (1, 1)).tobytes())
+            if len(Image.new(self.raw_mode, (8, 1)).tobytes()) != 8*pixel_bytes:
+                message = "[PSSM TiledImage] Unsupported raw mode : {}"
+                raise ValueError(message.format(self.raw_mode))
+            with open(self.image_input, "rb") as raw_file:
+                self.mapping = mmap.mmap(raw_file.fileno(), 0,
+                                         access=mmap.ACCESS_READ)
+            # The image reads the mapping directly: only the pages of the
+            # cropped regions are ever loaded
+            if self.raw_mode in MAPPED_MODES:
+                self.source = Image.frombuffer(self.raw_mode, self.raw_size,
+                                               self.mapping, "raw",
+                                               self.raw_mode, 0, 1)
+            else:
+                # Any other mode would be copied: the bytes are mapped as an
+                # "L" image instead, and the tiles are read from them
+                (w, h) = self.raw_size
+                self.source = Image.frombuffer("L", (w*pixel_bytes, h),
+                                               self.mapping, "raw", "L", 0, 1)
+                self.pixel_bytes = pixel_bytes
+        else:
+            self.source = Image.open(self.image_input)
+        return self.source
+
+    def _get_source_key(self):
+        """
+        Returns what the source is opened from
+        """
+        return (freeze(self.image_input), self.raw_size, self.raw_mode)
+
+    def _get_source_size(self):
+        """
+        Returns the (width, height) of the source image, in pixels
+        """
+        if self.raw_size is not None and isinstance(self.image_input, str):
+            return tuple(self.raw_size)
+        return self._get_source().size
+
+    def _crop_source(self, box):
+        """
+        Returns the given region of the source image
+        """
+        source = self._get_source()
+        if self.pixel_bytes is None:
+            return source.crop(box)
+        # Only the bytes of the region are copied, then read as pixels
+        (left, top, right, bottom) = box
+        n = self.pixel_bytes
+        region = source.crop((left*n, top, right*n, bottom))
+        return Image.frombytes(self.raw_mode, (right-left, bottom-top),
+                               region.tobytes())
+
+    def _get_scaled_source(self):
+        """
+        Returns the image to crop the tiles from, and its scale relative to
+        the source. When zoomed out, JPEG files are decoded at a reduced
+        scale (never smaller than needed), without decoding them fully.
+        """
+        source = self._get_source()
+        if self.scale >= 1 or not isinstance(self.image_input, str) or \
+                source.format != "JPEG":
+            # PIL images given as input are used as they are
+            return (source, 1)
+        requested = (ceil(source.width*self.scale),
+                     ceil(source.height*self.scale))
+        if self.draft_source is None or self.draft_source[0] != requested:
+            draft = Image.open(self.image_input)
+            draft.draft(draft.mode, requested)
+            self.draft_source = (requested, draft)
+        draft = self.draft_source[1]
+        return (draft, draft.width / source.width)
+
+    def _get_tile(self, tx, ty):
+        """
+        Returns the given tile of the current zoom level (rendering it if it
+        is not in the cache)
+        """
+        mode = self.get_mode()
+        self._get_source()      # Opened again if the image input changed
+        key = (self.id, self.source_version, mode, self.scale,
+               self.tile_size, freeze(self.background_color), tx, ty)
+        tile = tiles.get(key)
+        if tile is None:
+            tile = self._render_tile(tx, ty, mode)
+            tiles.put(key, tile)
+        return tile
+
+    def _render_tile(self, tx, ty, mode):
+        """
+        Crops the region of the source covered by the tile and scales it
+        """
+        (source_w, source_h) = self._get_source_size()
+        (scaled_source, factor) = self._get_scaled_source()
+        size = self.tile_size
+        scale = self.scale
+        tile = self.new_image((size, size), self.background_color)
+        # The region of the source, clamped to the image
+        left = max(floor(tx*size / scale), 0)
+        top = max(floor(ty*size / scale), 0)
+        right = min(ceil((tx+1)*size / scale), source_w)
+        bottom = min(ceil((ty+1)*size / scale), source_h)
+        if right <= left or bottom <= top:
+            # Outside of the image
+            return tile
+        if factor == 1:
+            region = self._crop_source((left, top, right, bottom))
+        else:
+            region = scaled_source.crop((
+                floor(left*factor), floor(top*factor),
+                min(ceil(right*factor), scaled_source.width),
+                min(ceil(bottom*factor), scaled_source.height)
+            ))
+        # And where it goes in the tile
+        dest_x = round(left*scale) - tx*size
+        dest_y = round(top*scale) - ty*size
+        dest_w = max(round(right*scale) - round(left*scale), 1)
+        dest_h = max(round(bottom*scale) - round(top*scale), 1)
+        if (dest_w, dest_h) != region.size:
+            region = region.resize((dest_w, dest_h),
+                                   reducing_gap=REDUCING_GAP)
+        tile.paste(convert_image(region, mode), (dest_x, dest_y))
+        return tile
+
+    def _clamp_position(self, position, scale):
+        """
+        Keeps the view inside the zoomed image (when it is larger than it)
+        """
+        (source_w, source_h) = self._get_source_size()
+        w, h = self.area[1]
+        (x, y) = position
+        max_x = max(int(source_w*scale) - w, 0)
+        max_y = max(int(source_h*scale) - h, 0)
+        return (min(max(int(x), 0), max_x), min(max(int(y), 0), max_y))
@@ -31,6 +31,11 @@ if __name__ == "__main__":
             typed_text = typed_text[:-1]
         elif keyType == KTcarriageReturn:
             typed_text += "\n"
+        elif keyType == KTcapsLock:
+            # Only the keys which differ are reprinted
+            osk.set_view('standard' if osk.view == 'caps' else 'caps')
+        elif keyType == KTalt:
+            osk.set_view('standard' if osk.view == 'alt' else 'alt')
         else:
             print("other keyType")
         # Debug
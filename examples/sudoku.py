@@ -5,18 +5,13 @@ import os
 from PSSM import Stack
 from PSSM.elements import Rectangle, Margin
 from PSSM.styles import DEFAULT as DEFAULT_STYLE
-from PSSM.layouts import Collection
+from PSSM.layouts import Collection, Grid
 from PSSM.layouts import OSK, KTstandardChar,KTcarriageReturn,KTbackspace, KTdelete, KTcapsLock, KTcontrol, KTalt
-import platform
 import random
-if platform.machine() in ["x86", "AMD64", "i686", "x86_64"]:
-    device = "Emulator"
-else:
-    device = "Kobo"
 
 # ###################### - INIT - ###########################################
 # Declare the Screen Stack Manager
-stack = Stack(device)
+stack = Stack()
 # Clear and refresh the stack
 stack.screen.clear()
 stack.screen.refresh()
@@ -92,9 +87,7 @@ def generateSudokuGrid(numberOfCells):
 # ###################### - GUI LOGIC - #######################################
 def getBoardLayout(grid):
     global elt_grid
-    board_coll_array = []
     for i in range(9):
-        board_row = [Margin(width=BIG_MARGIN)]
         for j in range(9):
             elt = Rectangle(
                 user_data = (i, j),
@@ -102,17 +95,13 @@ def getBoardLayout(grid):
             )
             elt.add_text(str(grid[i][j]), x="center", y="center")
             elt_grid[i][j] = elt
-            board_row.append(elt)
-            if j in [2, 5, 8]:
-                board_row.append(Margin(width=BIG_MARGIN))
-            else:
-                board_row.append(Margin(width=MARGIN))
-        board_coll_array.append(Collection(board_row, height="?"))
-        if i in [2, 5, 8]:
-            board_coll_array.append(Margin(height=BIG_MARGIN))
-        else:
-            board_coll_array.append(Margin(height=MARGIN))
-    return Collection(axis="y", coll=board_coll_array)
+    # A bigger gutter between the 3x3 squares
+    gutters = [BIG_MARGIN if k % 3 == 0 else MARGIN for k in range(10)]
+    return Grid(
+        cells = elt_grid,
+        col_gutter = gutters,
+        row_gutter = [0] + gutters[1:]
+    )
 
 
 def getDigitList():
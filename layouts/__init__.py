@@ -1,2 +1,4 @@
 from .collection import Collection
+from .virtual_list import VirtualList
+from .grid import Grid
 from .osk import OSK, KTstandardChar,KTcarriageReturn,KTbackspace, KTdelete, KTcapsLock, KTcontrol, KTalt
\ No newline at end of file
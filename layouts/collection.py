@@ -1,26 +1,97 @@
-from PIL import Image
+import os
+import threading
+from bisect import bisect_right
+from concurrent.futures import ThreadPoolExecutor
 from PSSM.elements import Element, Margin
-from PSSM.utils import coords_in_area
+from PSSM.utils import coords_in_area, freeze
+
+RENDER_WORKERS = min(4, os.cpu_count() or 1)
+RENDER_THREAD_PREFIX = "PSSM-render"
+ALIGNMENTS = ("stretch", "start", "center", "end")
+render_pool = None
+
+
+def get_render_pool():
+    """
+    Returns the thread pool used by the parallel Collections (created on
+    first use)
+    """
+    global render_pool
+    if render_pool is None:
+        render_pool = ThreadPoolExecutor(max_workers=RENDER_WORKERS,
+                                         thread_name_prefix=RENDER_THREAD_PREFIX)
+    return render_pool
+
+
+def is_render_worker():
+    """
+    Returns True if called from a thread of the render pool
+    """
+    return threading.current_thread().name.startswith(RENDER_THREAD_PREFIX)
+
+
+def solve_dimensions(layout, dims, size):
+    """
+    Returns the sizes, in pixels, of consecutive dimensions sharing the given
+    size. Every dimension is resolved once, in the context of the layout: the
+    fixed ones first, then the "?" based ones share what remains, in
+    proportion to their weight.
+    """
+    resolved = [layout._convert_dimension(dim) for dim in dims]
+    total_dim = 0
+    total_qm = 0
+    for dim in resolved:
+        if isinstance(dim, int):
+            total_dim += dim
+        else:
+            total_qm += layout._convert_dimension(dim, qm=1)
+    remaining_dim = size - total_dim
+    return [dim if isinstance(dim, int) else
+            layout._convert_dimension(dim, qm=remaining_dim/total_qm)
+            for dim in resolved]
+
 
 class Collection(Element):
     """
     A collection is basically a list of Elements.
     It can be either a row (axis="x", default option) or a column (axis="y")
+
+    Args:
+        axis str: "x" for a row, "y" for a column
+        align str: how the elements are sized and placed across the axis.
+            "stretch" (default) gives them the whole height of a row (or
+            width of a column). With "start", "center" or "end", they keep
+            their own height (or width), where "?" means the whole of it, and
+            are placed at the top, center or bottom (left, center, right).
+        parallel bool: whether to generate the elements which are not layouts
+            on a thread pool (Pillow releases the GIL for most of its work).
+            The nested Collections inherit it unless they set it themselves.
     """
-    def __init__(self, coll=[], area=None, axis="x", **kwargs):
+    __slots__ = ('background_color', 'parallel', 'coll', 'list_img',
+                 'list_area', 'hit_starts', 'axis', 'align', 'layout_key')
+
+    def __init__(self, coll=[], area=None, axis="x", align="stretch",
+                 parallel=None, **kwargs):
         super().__init__()
         self.background_color = None
+        self.parallel = parallel
         for param in kwargs:
             setattr(self, param, kwargs[param])
         self.coll = coll
-        self.list_img = []
-        self.list_area = []
+        self.list_img = []       # Images of the elements, of the last layout
+        self.list_area = []      # Areas of the elements, of the last layout
+        self.hit_starts = []     # Sorted start coordinate of each element
         self.axis = axis
+        self.align = align
+        self.layout_key = None   # What the last layout was solved for
         self.area = area
         self.onclick = self._dispatch_click
         self.is_layout = True
+        self.needs_layout = True
         if self.axis not in ('x', 'y'):
             raise ValueError("Incompatible axis type : {}".format(axis))
+        if self.align not in ALIGNMENTS:
+            raise ValueError("Incompatible alignment : {}".format(align))
 
     def generator_img(self, layout_only=False):
         """
@@ -30,7 +101,7 @@ class Collection(Element):
         self._make_list_area()
         self._make_list_img(layout_only)
         [(x, y), (w, h)] = self.area
-        self.image = Image.new("RGBA", (w, h), color=self.background_color)
+        self.image = self.new_image((w, h), self.background_color)
         for i in range(len(self.list_area)):
             elt_x, elt_y = self.list_area[i][0]
             relative_x = elt_x - x
@@ -38,6 +109,7 @@ class Collection(Element):
             elt_img = self.list_img[i]
             if elt_img is not None:
                 self.image.paste(self.list_img[i], (relative_x, relative_y))
+        self.needs_layout = False
         return self.image
 
     def _convert_coll(self):
@@ -58,98 +130,137 @@ class Collection(Element):
                 setattr(element, param, value)
                 self.coll[i] = element
             # Let's add parse a few elt-variables
-            self.coll[i].parent_layouts += self.parent_layouts
-            self.coll[i].parent_layouts += [self]
+            self.coll[i].parent = self
             self.coll[i].parent_stack = self.parent_stack
             self.coll[i]._parse_styles()
+            if self.coll[i].is_layout and getattr(self.coll[i], "parallel", False) is None:
+                self.coll[i].parallel = self.parallel
 
     def _make_list_img(self, layout_only=False):
         if not self.list_area:
             message = "[PSSM Layout] Error, list_area has to be defined first"
             raise NameError(message)
+        # The elements which are not layouts are independent: they can be
+        # generated on the pool while the nested layouts are generated here.
+        # (Workers do not submit jobs themselves, that could starve the pool)
+        jobs = {}
+        if self.parallel and not layout_only and not is_render_worker():
+            pool = get_render_pool()
+            for i in range(len(self.coll)):
+                elt = self.coll[i]
+                if not elt.is_layout and not isinstance(elt, Margin):
+                    jobs[i] = pool.submit(elt.generator, area=self.list_area[i],
+                                          skip_styles=True)
+        list_img = []
         for i in range(len(self.coll)):
             elt = self.coll[i]
             elt_area = self.list_area[i]
-            if not elt.is_layout and layout_only:
+            if i in jobs:
+                elt_img = jobs[i].result()
+            elif not elt.is_layout and layout_only:
+                elt_img = elt.image
+            elif elt.is_layout and not elt.needs_layout and elt.image is not None:
+                # Same area, and its children kept its image up to date
                 elt_img = elt.image
             else:
                 elt_img = elt.generator(area=elt_area, skip_styles=True)
-            self.list_img.append(elt_img)
+            list_img.append(elt_img)
+        # Replaced, not extended: it only holds the images of this layout
+        self.list_img = list_img
         return self.list_img
 
     def _make_list_area(self):
         """
         Builds the list of areas.
+        The dimensions are resolved once, in the context of the collection,
+        and the solution is kept until the area of the collection or the
+        dimensions of its elements change.
         """
-        # STATUS:  TODO
-        [(x, y), (w,h)] = self.area
-        x0, y0 = x, y
-        total_dim, total_qm = self._get_remaining_dim()
-        if self.axis ==  "x":
-            remaining_dim = w - total_dim
-            for elt in self.coll:
-                # TODO: handle when the users wants an element to be less high than the row's
-                # for now it has the row's height
-                elt_height = h
-                # Retrieve the width
-                elt_width = self._get_elt_dim(elt.width, remaining_dim, total_qm) 
-                elt.area = [(x0, y0), (elt_width-1, elt_height-1)]
-                x0 += elt_width
-                self.list_area.append(elt.area)
-        else:
-            remaining_dim = h - total_dim
-            for elt in self.coll:
-                # TODO: handle when the users wants an element to be less wide than the row's
-                # for now it has the row's width
-                elt_width = w
-                # Retrieve the height
-                elt_height = self._get_elt_dim(elt.height, remaining_dim, total_qm)
-                elt.area = [(x0, y0), (elt_width-1, elt_height-1)]
-                y0 += elt_height
-                self.list_area.append(elt.area)
-    
-    def _get_elt_dim(self, elt_width, remaining_dim, total_qm):
-        converted_width = self._convert_dimension(elt_width)
-        if isinstance(converted_width, int):
-            # we can go
-            return converted_width
+        [(x, y), (w, h)] = self.area
+        layout_key = (x, y, w, h, self.axis, self.align,
+                      tuple((id(elt), freeze(elt.width), freeze(elt.height))
+                            for elt in self.coll))
+        if layout_key == self.layout_key:
+            # Same solution: only put back the areas (an element could have
+            # been given another one in the meantime)
+            for elt, elt_area in zip(self.coll, self.list_area):
+                if elt.area != elt_area:
+                    elt.area = elt_area
+                    elt.needs_layout = elt.is_layout
+            return
+        if self.axis == "x":
+            main_dims = self._solve_main_axis([elt.width for elt in self.coll], w)
+            cross_dims = [elt.height for elt in self.coll]
+            cross_size = h
         else:
-            # There is still a question mark to parse
-            dim = converted_width.replace("?", str(remaining_dim))
-            dim += "/{}".format(total_qm)
-            try:
-                true_elt_width = int(eval(dim))
-            except ValueError:
-                raise ValueError("An invalid dimension was given \
-                as element width : {}".format(converted_width))
-            return true_elt_width
-
-    def _get_remaining_dim(self):
+            main_dims = self._solve_main_axis([elt.height for elt in self.coll], h)
+            cross_dims = [elt.width for elt in self.coll]
+            cross_size = w
+        list_area = []
+        start = x if self.axis == "x" else y
+        for elt, main_dim, cross_dim in zip(self.coll, main_dims, cross_dims):
+            elt_cross, offset = self._solve_cross_axis(cross_dim, cross_size)
+            if self.axis == "x":
+                elt_area = [(start, y+offset), (main_dim-1, elt_cross-1)]
+            else:
+                elt_area = [(x+offset, start), (elt_cross-1, main_dim-1)]
+            if elt.area != elt_area:
+                # Its own children have to be laid out again
+                elt.needs_layout = elt.is_layout
+            elt.area = elt_area
+            start += main_dim
+            list_area.append(elt.area)
+        self.list_area = list_area
+        self.layout_key = layout_key
+        # The elements are laid out one after the other along the axis, so
+        # their start coordinates are sorted: a click can be found by bisection
+        i = 0 if self.axis == "x" else 1
+        self.hit_starts = [elt.area[0][i] for elt in self.coll]
+
+    def _solve_main_axis(self, dims, size):
+        """
+        Returns the size of each element along the axis
+        """
+        return solve_dimensions(self, dims, size)
+
+    def _solve_cross_axis(self, dim, size):
+        """
+        Returns the size of an element across the axis, and its offset
+        """
+        if self.align == "stretch" or dim is None:
+            return (size, 0)
+        dim = self._convert_dimension(dim)
+        if not isinstance(dim, int):
+            # "?" is the whole size
+            dim = self._convert_dimension(dim, qm=size)
+        dim = min(max(dim, 0), size)
+        if self.align == "start":
+            return (dim, 0)
+        elif self.align == "center":
+            return (dim, (size-dim) // 2)
+        return (dim, size-dim)
+
+    def elt_at(self, click_x, click_y):
         """
-        Returns the total width + the total weight of "?" based dimensions
+        Returns the element at the given coordinates, or None.
+        Dichotomy search through the elements, along the axis
         """
-        total_dim = 0
-        total_qm = 0
-        for elt in self.coll:
-            dim = elt.width if self.axis == "x" else elt.height
-            converted_dim = elt._convert_dimension(dim)
-            if isinstance(converted_dim, int):
-                total_dim += converted_dim
-            elif isinstance(converted_dim, str) and "?" in converted_dim:
-                dim = converted_dim.replace("?", "1")
-                qm_weight = int(eval(dim))
-                total_qm += qm_weight
-        return (total_dim, total_qm)
+        click = click_x if self.axis == "x" else click_y
+        i = bisect_right(self.hit_starts, click) - 1
+        if i < 0:
+            return None
+        elt = self.coll[i]
+        if coords_in_area(elt.area, click_x, click_y):
+            return elt
+        return None
 
     def _dispatch_click(self, _, coords):
         """
         Dispatches the click.
-        Linear search through the elements
         """
         click_x, click_y = coords
-        ## TODO : implement dichotomy search
-        for elt in self.coll:
-            if coords_in_area(elt.area, click_x, click_y):
-                self.parent_stack._click_handler_to_elt(elt, (click_x, click_y))
-                return True
-        return False
+        elt = self.elt_at(click_x, click_y)
+        if elt is None:
+            return False
+        self.parent_stack._click_handler_to_elt(elt, (click_x, click_y))
+        return True
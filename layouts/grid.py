@@ -0,0 +1,170 @@
+from bisect import bisect_right
+from PSSM.elements import Element
+from PSSM.layouts.collection import solve_dimensions
+from PSSM.utils import coords_in_area, freeze
+
+
+class Grid(Element):
+    """
+    A 2D grid of elements (like a sudoku board or a calendar), laid out in a
+    single pass: the row heights and the column widths are resolved once,
+    and a click is mapped to its cell by bisection.
+    The cells are regular children: updating one only redraws it.
+
+    Args:
+        cells list: The rows of the grid, each one a list of elements (None
+            for an empty cell)
+        rows list: The height of each row (defaults to "?" for all of them)
+        cols list: The width of each column (defaults to "?" for all of them)
+        row_gutter int, str or list: The space between the rows. One
+            dimension for all of them, or a list of len(rows)-1 dimensions
+            (one between each row), or of len(rows)+1 dimensions (with the
+            space above the first row and below the last one)
+        col_gutter int, str or list: Same, for the space between the columns
+        background_color : an RGBA color, for the gutters
+    """
+    __slots__ = ('background_color', 'cells', 'rows', 'cols', 'row_gutter',
+                 'col_gutter', 'row_starts', 'col_starts', 'row_heights',
+                 'col_widths', 'layout_key')
+
+    def __init__(self, cells=[], rows=None, cols=None, row_gutter=0,
+                 col_gutter=0, area=None, **kwargs):
+        super().__init__()
+        self.background_color = None
+        for param in kwargs:
+            setattr(self, param, kwargs[param])
+        self.cells = cells
+        n_cols = max((len(row) for row in cells), default=0)
+        self.rows = rows if rows is not None else ["?"] * len(cells)
+        self.cols = cols if cols is not None else ["?"] * n_cols
+        self.row_gutter = row_gutter
+        self.col_gutter = col_gutter
+        self.row_starts = []     # Sorted y of each row
+        self.col_starts = []     # Sorted x of each column
+        self.row_heights = []
+        self.col_widths = []
+        self.layout_key = None   # What the last layout was solved for
+        self.area = area
+        self.onclick = self._dispatch_click
+        self.is_layout = True
+        self.needs_layout = True
+
+    def generator_img(self, layout_only=False):
+        """
+        Lays out the cells and builds one image out of them
+        """
+        self._convert_cells()
+        self._make_cell_areas()
+        [(x, y), (w, h)] = self.area
+        self.image = self.new_image((w, h), self.background_color)
+        for elt, (i, j) in self._iter_cells():
+            elt_area = self.get_cell_area(i, j)
+            if not elt.is_layout and layout_only:
+                elt_img = elt.image
+            elif elt.is_layout and not elt.needs_layout and elt.image is not None:
+                # Same area, and its children kept its image up to date
+                elt_img = elt.image
+            else:
+                elt_img = elt.generator(area=elt_area, skip_styles=True)
+            if elt_img is not None:
+                (elt_x, elt_y) = elt_area[0]
+                self.image.paste(elt_img, (elt_x - x, elt_y - y))
+        self.needs_layout = False
+        return self.image
+
+    def get_cell_area(self, i, j):
+        """
+        Returns the area of the cell at row i, column j
+        """
+        return [(self.col_starts[j], self.row_starts[i]),
+                (self.col_widths[j], self.row_heights[i])]
+
+    def cell_at(self, click_x, click_y):
+        """
+        Returns the (row, column) of the cell at the given coordinates, or
+        None (outside of the grid, or in a gutter)
+        """
+        i = bisect_right(self.row_starts, click_y) - 1
+        j = bisect_right(self.col_starts, click_x) - 1
+        if i < 0 or j < 0:
+            return None
+        if not coords_in_area(self.get_cell_area(i, j), click_x, click_y):
+            return None
+        return (i, j)
+
+    def _iter_cells(self):
+        """
+        Yields the elements with their (row, column)
+        """
+        for i, row in enumerate(self.cells):
+            for j, elt in enumerate(row):
+                if elt is not None:
+                    yield elt, (i, j)
+
+    def _convert_cells(self):
+        """
+        Makes the cells children of the grid
+        """
+        for elt, _ in self._iter_cells():
+            elt.parent = self
+            elt.parent_stack = self.parent_stack
+            elt._parse_styles()
+
+    def _make_cell_areas(self):
+        """
+        Resolves the row heights and the column widths (once, unless the area
+        or the dimensions changed), then gives each cell its area
+        """
+        [(x, y), (w, h)] = self.area
+        layout_key = (x, y, w, h, freeze(self.rows), freeze(self.cols),
+                      freeze(self.row_gutter), freeze(self.col_gutter))
+        if layout_key != self.layout_key:
+            (self.row_starts, self.row_heights) = \
+                self._solve_axis(self.rows, self.row_gutter, y, h)
+            (self.col_starts, self.col_widths) = \
+                self._solve_axis(self.cols, self.col_gutter, x, w)
+            self.layout_key = layout_key
+        for elt, (i, j) in self._iter_cells():
+            elt_area = self.get_cell_area(i, j)
+            if elt.area != elt_area:
+                # Its own children have to be laid out again
+                elt.needs_layout = elt.is_layout
+                elt.area = elt_area
+
+    def _solve_axis(self, dims, gutter, start, size):
+        """
+        Returns the start coordinate and the size of each row (or column)
+        """
+        n = len(dims)
+        if isinstance(gutter, (list, tuple)):
+            gutters = list(gutter)
+        else:
+            gutters = [gutter] * max(n-1, 0)
+        if len(gutters) == max(n-1, 0):
+            gutters = [0] + gutters + [0]
+        elif len(gutters) != n+1:
+            message = "[PSSM Grid] Expected {} or {} gutters, got {}"
+            raise ValueError(message.format(n-1, n+1, len(gutters)))
+        # The gutters and the cells share the size, in a single pass
+        solved = solve_dimensions(self, gutters + list(dims), size)
+        gutter_sizes, sizes = solved[:n+1], solved[n+1:]
+        starts = []
+        for k in range(n):
+            start += gutter_sizes[k]
+            starts.append(start)
+            start += sizes[k]
+        return (starts, sizes)
+
+    def _dispatch_click(self, _, coords):
+        """
+        Dispatches the click to the cell under it
+        """
+        click_x, click_y = coords
+        cell = self.cell_at(click_x, click_y)
+        if cell is None:
+            return False
+        (i, j) = cell
+        if j >= len(self.cells[i]) or self.cells[i][j] is None:
+            return False
+        self.parent_stack._click_handler_to_elt(self.cells[i][j], coords)
+        return True
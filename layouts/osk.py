@@ -1,6 +1,8 @@
 import os
 import json
+import threading
 from PSSM.layouts import Collection
+from PSSM.layouts.collection import get_render_pool
 from PSSM.elements import Element, Rectangle
 
 ########### Constants
@@ -38,6 +40,9 @@ class OSKButton(Rectangle):
     """
     A button for the OSK
     """
+    __slots__ = ('key_type', 'key_is_padding', 'key_char', 'on_key_press',
+                 'key_label')
+
     def __init__(self, key_type, key_char="", key_is_padding=False, on_key_press=None, **kwargs):
         super().__init__()
         self.key_type = key_type
@@ -89,6 +94,10 @@ class OSK(Element):
         on_key_press (function): A callback function. Will be given keyType and
             keyChar as argument
     """
+    __slots__ = ('keymap', 'keymap_coll', 'keymap_imgs', 'keymap_paths',
+                 'lang', 'on_key_press', 'view', 'coll', 'render_lock',
+                 'prerender_job')
+
     def __init__(self, keymap_path=DEFAULT_KEYMAP_PATH, on_key_press=None,
                  area=None, **kwargs):
         super().__init__()
@@ -101,6 +110,8 @@ class OSK(Element):
         self.keymap = {'standard': None, 'caps': None, 'alt': None}
         self.keymap_coll = {'standard': None, 'caps': None, 'alt': None}
         self.keymap_imgs = {'standard': None, 'caps': None, 'alt': None}
+        self.render_lock = threading.Lock()
+        self.prerender_job = None
         self.keymap_paths = keymap_path if keymap_path else DEFAULT_KEYMAP_PATH
         # Load keymaps
         with open(self.keymap_paths['standard']) as json_file:
@@ -122,24 +133,144 @@ class OSK(Element):
         # the keyboard images are going to be created on generator_img call
         # Initialize layout with standard view
         self.coll = self.keymap_coll[self.view]
-        self.onclick = self.coll.onclick
+        self.onclick = self._on_click
         for param in kwargs:
             setattr(self, param, kwargs[param])
 
     def generator_img(self, layout_only=False):
         """
         This generator is a bit special : we don't want it to regenerate
-        everything everytime we change view. So we will generate all the views
-        at once the first time. Then, unless asked to, we will only return the
-        appropriate image.
-        """
-        if not self.keymap_imgs[self.view]: 
-            self.keymap_coll[self.view].area = self.area
-            self.keymap_coll[self.view].parent_stack = self.parent_stack
-            self.keymap_imgs[self.view] = self.keymap_coll[self.view].generator_img()
-        self.image = self.keymap_imgs[self.view]
+        everything everytime we change view. The current view is generated
+        first, then the other ones are rendered in the background, so that
+        switching views later on does not have to wait for them.
+        """
+        self.image = self._render_view(self.view)
+        if self.prerender_job is None:
+            self.prerender_job = get_render_pool().submit(self.prerender)
         return  self.image
 
+    def prerender(self):
+        """
+        Renders all the views which were not rendered yet
+        """
+        for view in self.keymap_coll:
+            self._render_view(view)
+
+    def set_view(self, view):
+        """
+        Switches to another view ('standard', 'caps' or 'alt'). Only the keys
+        which differ between the two views are reprinted (unless the keys are
+        not laid out the same way).
+        """
+        if view == self.view:
+            return
+        previous_coll = self.keymap_coll[self.view]
+        image = self._render_view(view)
+        self.view = view
+        self.coll = self.keymap_coll[view]
+        self.image = image
+        if self.parent_stack is None or not self.is_generated:
+            return
+        changed_areas = self._diff_views(previous_coll, self.coll)
+        if changed_areas is None:
+            self.parent_stack.print_stack(area=self.area)
+        else:
+            self.parent_stack.print_stack(areas=changed_areas)
+
+    def key_at(self, click_x, click_y):
+        """
+        Returns the key of the current view at the given coordinates, or None
+        """
+        elt = self.coll
+        while elt is not None and not isinstance(elt, OSKButton):
+            if not elt.is_layout:
+                return None
+            elt = elt.elt_at(click_x, click_y)
+        return elt
+
+    def key_areas(self):
+        """
+        Returns the area of every key of the current view, shape {key: area}.
+        A key can be reprinted on its own, without the rest of the keyboard.
+        """
+        return {key: key.area for key in self._iter_keys(self.coll)}
+
+    def _on_click(self, _, coords):
+        """
+        Handles the key presses. The pressed key is inverted right away, then
+        whatever the callback updates (like the text field) is printed along
+        with the key being restored, in a single refresh.
+        """
+        key = self.key_at(*coords)
+        if key is None:
+            return False
+        stack = self.parent_stack
+        delay = 0
+        if key.onclick_invert:
+            x, y = key.area[0]
+            stack.screen.print(key.image, x, y, inverted=not key.is_inverted,
+                               fast_invertion=True)
+            delay = key.onclick_invert_duration
+
+        def restore_key():
+            if key.onclick_invert:
+                # The buffer holds the key as it should be
+                stack._print_buffer_area(key.area)
+            stack.end_batch()
+
+        stack.begin_batch()
+        try:
+            if key.onclick is not None:
+                key.onclick(key, coords)
+        finally:
+            if delay:
+                stack.screen.after(delay, restore_key)
+            else:
+                restore_key()
+        return True
+
+    def _render_view(self, view):
+        """
+        Returns the image of the view, rendering it if needed (or if the
+        keyboard area changed)
+        """
+        with self.render_lock:
+            coll = self.keymap_coll[view]
+            if not self.keymap_imgs[view] or coll.area != self.area:
+                coll.area = self.area
+                coll.parent_stack = self.parent_stack
+                self.keymap_imgs[view] = coll.generator_img()
+            return self.keymap_imgs[view]
+
+    def _diff_views(self, previous_coll, coll):
+        """
+        Returns the areas of the keys which look different in the two views,
+        or None if their keys are not at the same places
+        """
+        previous_keys = list(self._iter_keys(previous_coll))
+        keys = list(self._iter_keys(coll))
+        if len(previous_keys) != len(keys):
+            return None
+        changed_areas = []
+        for previous_key, key in zip(previous_keys, keys):
+            if previous_key.area != key.area:
+                return None
+            is_same = key.fingerprint is not None and \
+                      key.fingerprint == previous_key.fingerprint
+            if not is_same:
+                changed_areas.append(key.area)
+        return changed_areas
+
+    def _iter_keys(self, coll):
+        """
+        Yields the keys of the view, row by row
+        """
+        for elt in coll.coll:
+            if isinstance(elt, OSKButton):
+                yield elt
+            elif elt.is_layout:
+                yield from self._iter_keys(elt)
+
     def build_layout(self, keymap):
         # TODO : To be checked
         rows = []
@@ -0,0 +1,228 @@
+import threading
+from PSSM.elements import Element
+from PSSM.layouts.collection import get_render_pool
+from PSSM.utils import LRUCache
+
+CACHED_PAGES = 3        # The current page and the adjacent ones
+
+
+class VirtualList(Element):
+    """
+    A list of items which can be much longer than the screen (like a library
+    with thousands of books), shown one page at a time.
+
+    Only the rows of the pages in the cache are elements: they are created by
+    the row factory, and recycled (given back to the factory) when their page
+    leaves the cache. Once a page is shown, the adjacent ones are rendered in
+    advance on the render pool, with rows of their own which are not on the
+    screen: going to the next or previous page only has to print it. Memory
+    and rendering time depend on the number of rows on the screen, not on
+    the length of the list.
+
+    Args:
+        data list: The items (anything with len() and indexing)
+        row_factory function: Called as row_factory(item, recycled_elt) to
+            get the element showing the item. recycled_elt is an element
+            which showed another item, or None: the factory can update it
+            and return it instead of creating a new one. It may be called
+            from a thread of the render pool.
+        row_height int or str: The height of a row (like 60 or "H*0.08")
+        page int: The page to show first
+        cached_pages int: The number of page images to keep (the adjacent
+            pages are only rendered in advance if it is at least 3)
+        background_color : an RGBA color, for the empty rows
+    """
+    __slots__ = ('data', 'row_factory', 'row_height', 'page', 'rows',
+                 'page_rows', 'spare_rows', 'page_cache', 'render_lock',
+                 'prefetch_job', 'background_color')
+
+    def __init__(self, data, row_factory, row_height=60, page=0,
+                 cached_pages=CACHED_PAGES, area=None, **kwargs):
+        super().__init__()
+        self.background_color = None
+        for param in kwargs:
+            setattr(self, param, kwargs[param])
+        self.data = data
+        self.row_factory = row_factory
+        self.row_height = row_height
+        self.page = page
+        self.rows = []              # The rows of the current page
+        self.page_rows = {}         # Shape {page: rows}, for the cached pages
+        self.spare_rows = []        # Kept for recycling
+        self.page_cache = LRUCache(cached_pages)
+        self.render_lock = threading.Lock()
+        self.prefetch_job = None
+        self.area = area
+        self.onclick = self._dispatch_click
+        self.is_layout = True
+        self.needs_layout = True
+
+    def generator_img(self, layout_only=False):
+        """
+        Returns the image of the current page (rendering its rows only if it
+        is not in the cache), then renders the adjacent pages in the
+        background
+        """
+        with self.render_lock:
+            key = self._get_page_key(self.page)
+            image = None if self.needs_layout else self.page_cache.get(key)
+            rows = self.page_rows.get(self.page)
+            if image is None or rows is None:
+                (rows, image) = self._render_page(self.page)
+            # Only the rows of the current page paste their updates in its
+            # cached image
+            for page, page_rows in self.page_rows.items():
+                parent = self if page == self.page else None
+                for row in page_rows:
+                    row.parent = parent
+            self.rows = rows
+            self.image = image
+            self.needs_layout = False
+        if self.page_cache.max_size >= 3:
+            self.prefetch_job = get_render_pool().submit(self.prefetch,
+                                                         self.page)
+        return self.image
+
+    def prefetch(self, page):
+        """
+        Renders the pages next to the given one, if it is still the current
+        page (called on the render pool)
+        """
+        with self.render_lock:
+            if page != self.page or self.needs_layout:
+                return
+            adjacent_pages = [adjacent for adjacent in (page+1, page-1)
+                              if 0 <= adjacent < self.get_page_count()]
+            # The pages to keep become the most recently used ones, so that
+            # only the other pages are evicted
+            for kept_page in adjacent_pages + [page]:
+                self.page_cache.get(self._get_page_key(kept_page))
+            for adjacent in adjacent_pages:
+                key = self._get_page_key(adjacent)
+                if key not in self.page_cache or \
+                        adjacent not in self.page_rows:
+                    self._render_page(adjacent)
+
+    def get_rows_per_page(self):
+        """
+        Returns the number of rows which fit in the area
+        """
+        row_height = self._get_row_height()
+        return max(self.area[1][1] // row_height, 1)
+
+    def get_page_count(self):
+        """
+        Returns the number of pages
+        """
+        rows_per_page = self.get_rows_per_page()
+        return max((len(self.data) + rows_per_page - 1) // rows_per_page, 1)
+
+    def go_to_page(self, page, skip_print=False):
+        """
+        Shows the given page (clamped to the existing ones)
+        """
+        page = min(max(page, 0), self.get_page_count() - 1)
+        if page == self.page:
+            return True
+        return self.update({'page': page}, skip_print=skip_print)
+
+    def next_page(self, skip_print=False):
+        """
+        Shows the next page, if any
+        """
+        return self.go_to_page(self.page + 1, skip_print=skip_print)
+
+    def previous_page(self, skip_print=False):
+        """
+        Shows the previous page, if any
+        """
+        return self.go_to_page(self.page - 1, skip_print=skip_print)
+
+    def refresh(self, data=None, skip_print=False):
+        """
+        To be called when the items changed (or to give new ones): forgets
+        the rendered pages and shows the current one again
+        """
+        with self.render_lock:
+            if data is not None:
+                self.data = data
+            self.page_cache.clear()
+            self._drop_evicted_pages()
+            self.needs_layout = True
+            self.page = min(self.page, self.get_page_count() - 1)
+        return self.update({}, skip_print=skip_print)
+
+    def _get_row_height(self):
+        """
+        Returns the height of a row, in pixels
+        """
+        return max(self._convert_dimension(self.row_height, qm=1), 1)
+
+    def _get_row_count(self, page):
+        """
+        Returns the number of rows of the page (the last one may not be full)
+        """
+        rows_per_page = self.get_rows_per_page()
+        first = page * rows_per_page
+        return max(min(rows_per_page, len(self.data) - first), 0)
+
+    def _get_page_key(self, page):
+        """
+        Returns the key of the image of the page in the cache
+        """
+        (w, h) = self.area[1]
+        return (page, w, h, self.get_mode(), self.row_height)
+
+    def _render_page(self, page):
+        """
+        Makes rows show the items of the page (recycling the row elements
+        which are not needed anymore), generates them, and caches the image
+        of the page. Returns the rows and the image.
+        """
+        [(x, y), (w, h)] = self.area
+        row_height = self._get_row_height()
+        first = page * self.get_rows_per_page()
+        recycled = self.page_rows.pop(page, []) + self.spare_rows
+        rows = []
+        for i in range(self._get_row_count(page)):
+            recycled_row = recycled.pop(0) if recycled else None
+            row = self.row_factory(self.data[first + i], recycled_row)
+            row.parent = None
+            row.parent_stack = self.parent_stack
+            row._parse_styles()
+            row.generator(area=[(x, y + i*row_height), (w, row_height)],
+                          skip_styles=True)
+            rows.append(row)
+        self.spare_rows = recycled
+        image = self.new_image((w, h), self.background_color)
+        for row in rows:
+            if row.image is not None:
+                (row_x, row_y) = row.area[0]
+                image.paste(row.image, (row_x - x, row_y - y))
+        self.page_rows[page] = rows
+        self.page_cache.put(self._get_page_key(page), image)
+        self._drop_evicted_pages()
+        return (rows, image)
+
+    def _drop_evicted_pages(self):
+        """
+        Keeps the rows of the pages which left the cache for recycling
+        """
+        for page in list(self.page_rows):
+            if self._get_page_key(page) not in self.page_cache:
+                rows = self.page_rows.pop(page)
+                for row in rows:
+                    row.parent = None
+                self.spare_rows += rows
+
+    def _dispatch_click(self, _, coords):
+        """
+        Dispatches the click to the row under it (found arithmetically)
+        """
+        click_x, click_y = coords
+        [(x, y), (w, h)] = self.area
+        i = (click_y - y) // self._get_row_height()
+        if i < 0 or i >= len(self.rows):
+            return False
+        self.parent_stack._click_handler_to_elt(self.rows[i], coords)
+        return True
@@ -1,10 +1,38 @@
+import asyncio
 from platform import machine
+from contextlib import contextmanager
+from threading import RLock
+from time import perf_counter
 from PIL import Image
-from .utils import coords_in_area
+from .utils import intersect_areas, merge_areas, convert_color
+from .spatial import SpatialGrid
+from .zorder import ZOrder
 from .styles import DEFAULT as DEFAULT_STYLE
 
+WHITE = (255, 255, 255, 255)
+MODES = ("RGBA", "L")
+
+
 class Stack():
-    def __init__(self, style=DEFAULT_STYLE):
+    """
+    The Screen Stack Manager
+
+    Args:
+        style dict: the style of the elements (see PSSM.styles)
+        frame_window int: time in milliseconds during which the print requests
+            are merged into a single frame (0 to print them right away)
+        frame_budget int: maximum time in milliseconds spent compositing a
+            frame. The areas which do not fit are left for the next frame.
+            (None for no limit)
+        mode str: the image mode of the whole pipeline, "RGBA" or "L". In "L"
+            mode, the elements are generated and composited in 8-bit
+            grayscale, which is what e-ink screens display anyway (4 times
+            less memory, and 4 times less data sent to the screen)
+    """
+    def __init__(self, style=DEFAULT_STYLE, frame_window=0, frame_budget=None,
+                 mode="RGBA"):
+        if mode not in MODES:
+            raise ValueError("Unsupported image mode : {}".format(mode))
         if machine() in ["x86", "AMD64", "i686", "x86_64"]:
             import PSSM.devices.emulator as pssm_device
         else:
@@ -12,42 +40,250 @@ class Stack():
         self.screen = pssm_device.Screen(onclick_handler=self._click_handler)
         self.hardware = pssm_device.Hardware()
         self.style = style
-        self.stack = []
+        self.style_version = 0      # Bumped by set_style
+        self.style_tables = {}      # Shape {element type: resolved style}
+        self.mode = mode
+        self.white = convert_color(WHITE, mode)
+        self.stack = ZOrder()
+        self.hit_index = SpatialGrid()
+        # Batch transactions (see Stack.batch)
+        self.batch_depth = 0
+        self.pending_adds = {}      # Used as an ordered set
+        self.pending_updates = {}   # Shape {elt: (print it?, displayed state)}
+        # Frame scheduler (see Stack.render_frame)
+        self.frame_window = frame_window
+        self.frame_budget = frame_budget
+        self.frame_lock = RLock()
+        self.is_frame_scheduled = False
+        self.damaged_areas = []     # To composite then print
+        self.ready_areas = []       # Up to date in the buffer, to print
+        # Event loop (see Stack.mainloop)
+        self.loop = None
+        self.quit_event = None
+        self.pending_tasks = []
+        # The back buffer always holds what is displayed on the screen, so that
+        # partial updates only touch the pixels that changed
+        dim = (self.screen.width, self.screen.height)
+        self.buffer = Image.new(mode, dim, color=self.white)
+        if self.screen.image is None:
+            # The device does not keep a copy of the screen: it can use ours
+            self.screen.image = self.buffer
+
+    def set_style(self, style):
+        """
+        Changes the style of the stack. It applies to the styles which are
+        resolved from now on (the elements generated for the first time).
+        The resolved styles are cached: after editing the style in place, call
+        set_style again for the change to be seen.
+        """
+        self.style = style
+        # Invalidates the style tables resolved with the previous style
+        self.style_version += 1
+        self.style_tables = {}
 
     def mainloop(self):
         """
-        Actually starts the program
+        Actually starts the program: runs the asyncio event loop which handles
+        the input, the timers and the tasks, until Stack.quit is called
         """
-        self.screen._start()
+        asyncio.run(self.async_mainloop())
 
-    def print_stack(self, area=None):
-        # TODO: optimize ?
-        dim = (self.screen.width, self.screen.height)
-        white = (255, 255, 255, 255)
-        img = Image.new("RGBA", dim, color=white)
-        for elt in self.stack:
-            (x, y) = elt.area[0]
-            if elt.is_layout:
-                elt.generator(layout_only=True)
-            elif not elt.is_generated:
+    async def async_mainloop(self):
+        """
+        Same as mainloop, to be awaited from an already running event loop
+        """
+        self.loop = asyncio.get_running_loop()
+        self.quit_event = asyncio.Event()
+        self.screen._attach_loop(self.loop, on_quit=self.quit)
+        pending_tasks, self.pending_tasks = self.pending_tasks, []
+        tasks = [self.loop.create_task(coro) for coro in pending_tasks]
+        try:
+            await self.quit_event.wait()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.screen._detach_loop()
+            self.loop = None
+
+    def run_task(self, coro):
+        """
+        Runs a coroutine on the event loop (a network fetch for instance),
+        without blocking the input. If the loop is not started yet, the
+        coroutine will be started with it.
+
+        Returns:
+            The asyncio Task (a concurrent Future if called from another
+            thread), or None if the loop is not started yet
+        """
+        if self.loop is None:
+            self.pending_tasks.append(coro)
+            return None
+        try:
+            is_loop_thread = asyncio.get_running_loop() is self.loop
+        except RuntimeError:
+            is_loop_thread = False
+        if is_loop_thread:
+            return self.loop.create_task(coro)
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def quit(self):
+        """
+        Stops the main loop
+        """
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.quit_event.set)
+
+    def print_stack(self, area=None, areas=None):
+        """
+        Reprints the stack on the screen. The areas are queued for the next
+        frame (see Stack.render_frame).
+
+        Args:
+            area list: the area to reprint (the whole screen if omitted)
+            areas list: a list of dirty areas. Only the elements intersecting
+                them are composited.
+        """
+        if areas is None:
+            areas = [area] if area else [self.screen.area]
+        with self.frame_lock:
+            self.damaged_areas += areas
+        if self.batch_depth == 0:
+            # Otherwise, it will be printed at the end of the batch
+            self._request_frame()
+
+    def _request_frame(self):
+        """
+        Renders a frame right away, or within the frame window if there is one.
+        Requests arriving before the frame is rendered are merged into it.
+        """
+        if not self.frame_window:
+            self.render_frame()
+            return
+        with self.frame_lock:
+            if self.is_frame_scheduled:
+                return
+            self.is_frame_scheduled = True
+        self.screen.after(self.frame_window, self.render_frame)
+
+    def render_frame(self):
+        """
+        Composites the damaged areas and prints them with a single refresh.
+        If compositing takes longer than the frame budget, the remaining areas
+        are left for the next frame.
+        """
+        with self.frame_lock:
+            self.is_frame_scheduled = False
+            damaged_areas, self.damaged_areas = self.damaged_areas, []
+            ready_areas, self.ready_areas = self.ready_areas, []
+            start = perf_counter()
+            images = []
+            areas = merge_areas(damaged_areas)
+            for i, dirty_area in enumerate(areas):
+                elapsed = (perf_counter() - start) * 1000
+                if images and self.frame_budget and elapsed > self.frame_budget:
+                    self.damaged_areas += areas[i:]
+                    break
+                # Never composite outside of the screen
+                dirty_area = intersect_areas(dirty_area, self.screen.area)
+                if dirty_area is None:
+                    continue
+                img = self._composite(dirty_area)
+                (x, y) = dirty_area[0]
+                images.append((img, x, y))
+            for ready_area in ready_areas:
+                # Those are already up to date in the buffer
+                ready_area = intersect_areas(ready_area, self.screen.area)
+                if ready_area is not None:
+                    images.append((self.capture(ready_area), *ready_area[0]))
+            is_late = len(self.damaged_areas) > 0
+            if is_late:
+                self.is_frame_scheduled = True
+        if len(images) == 1:
+            self.screen.print(*images[0])
+        elif images:
+            # Several areas, but a single refresh
+            self.screen.print_many(images)
+        if is_late:
+            self.screen.after(self.frame_window or 0, self.render_frame)
+
+    def _composite(self, area):
+        """
+        Redraws the given area of the back buffer, using only the elements
+        which intersect it, and returns the corresponding image
+        """
+        [(x, y), (w, h)] = area
+        box = (x, y, x+w, y+h)
+        # Walk down the stack until an opaque element hides everything below
+        visible = []
+        is_covered = False
+        for elt in reversed(self.stack):
+            if not elt.is_generated:
+                # The area is only known once the element has been generated
+                elt.generator()
+            visible_area = intersect_areas(elt.area, area)
+            if visible_area is None:
+                continue
+            visible.append((elt, visible_area))
+            if visible_area == area and elt.is_opaque():
+                is_covered = True
+                break
+        if not is_covered:
+            self.buffer.paste(self.white, box)
+        # Then paste the visible elements, bottom to top
+        for elt, visible_area in reversed(visible):
+            if elt.is_layout and elt.needs_layout:
+                # Otherwise, its image was kept up to date by its children
                 elt.generator()
             if elt.image is not None:
-                img.paste(elt.image, (x, y))
-        if area:
-            [(x, y), (w, h)] = area
-            box = (x, y, x+w, y+h)
-            img = img.crop(box=box)
+                self._paste_in_buffer(elt, visible_area)
+        return self.buffer.crop(box)
+
+    def _paste_in_buffer(self, elt, area):
+        """
+        Pastes the part of the element's image which is in the given area
+        onto the back buffer
+        """
+        (elt_x, elt_y) = elt.area[0]
+        [(x, y), (w, h)] = area
+        if (w, h) == elt.image.size:
+            self.buffer.paste(elt.image, (x, y))
         else:
-            (x, y) = self.screen.area[0]
-        self.screen.print(img, x, y)
-        
+            box = (x-elt_x, y-elt_y, x-elt_x+w, y-elt_y+h)
+            self.buffer.paste(elt.image.crop(box), (x, y))
+
+    def capture(self, area=None):
+        """
+        Returns a copy of what is currently displayed, read from the back
+        buffer (no composition involved)
+
+        Args:
+            area list: the area to capture (the whole screen if omitted)
+        """
+        if area is None:
+            return self.buffer.copy()
+        [(x, y), (w, h)] = area
+        return self.buffer.crop((x, y, x+w, y+h))
+
     def _print_elt(self, elt):
         """
         Actually prints the element. Does not call the generator
         """
-        # Then, we print it
-        x, y = elt.area[0]
-        self.screen.print(elt.image, x, y)
+        visible_area = intersect_areas(elt.area, self.screen.area)
+        if visible_area is None:
+            return
+        with self.frame_lock:
+            self._paste_in_buffer(elt, visible_area)
+        self._print_buffer_area(visible_area)
+
+    def _print_buffer_area(self, area):
+        """
+        Prints an area of the buffer as it is, on the next frame
+        """
+        with self.frame_lock:
+            self.ready_areas.append(area)
+        if self.batch_depth == 0:
+            # Otherwise, it will be printed at the end of the batch
+            self._request_frame()
 
     def add(self, elt):
         """
@@ -55,25 +291,184 @@ class Stack():
         """
         elt.parent_stack = self
         self.stack.append(elt)
+        if self.batch_depth > 0:
+            # It will be generated and printed at the end of the batch
+            self.pending_adds[elt] = True
+            return
         elt.generator()
+        self.hit_index.insert(elt, elt.area)
         self._print_elt(elt)
+
+    def insert_at(self, elt, index):
+        """
+        Inserts an element in the stack at the given position, from the bottom
+        (0), and prints it. If it is already in the stack, it is moved there.
+        """
+        if elt in self.stack:
+            self.stack.insert_at(elt, index)
+            if elt not in self.pending_adds:
+                self.print_stack(area=elt.area)
+            return
+        elt.parent_stack = self
+        self.stack.insert_at(elt, index)
+        if self.batch_depth > 0:
+            # It will be generated and printed at the end of the batch
+            self.pending_adds[elt] = True
+            return
+        elt.generator()
+        self.hit_index.insert(elt, elt.area)
+        self.print_stack(area=elt.area)
+
+    def raise_to_top(self, elt):
+        """
+        Moves an element of the stack to the top, and prints it
+        """
+        self.stack.raise_to_top(elt)
+        if elt not in self.pending_adds:
+            # Being on top, it can be printed as it is
+            self._print_elt(elt)
+
+    def lower(self, elt):
+        """
+        Moves an element of the stack to the bottom, and prints its area
+        """
+        self.stack.lower(elt)
+        if elt not in self.pending_adds:
+            self.print_stack(area=elt.area)
     
     def remove(self, elt, skip_print=False):
         """
         Removes an element from the stack
         """
         self.stack.remove(elt)
+        self.hit_index.remove(elt)
+        if self.pending_adds.pop(elt, None):
+            # It has never been printed
+            return
+        self.pending_updates.pop(elt, None)
         if not skip_print:
             self.print_stack(area=elt.area)
 
+    def add_many(self, elts):
+        """
+        Adds several elements to the stack, and prints them all at once
+        """
+        with self.batch():
+            for elt in elts:
+                self.add(elt)
+
+    @contextmanager
+    def batch(self):
+        """
+        Context manager which defers the generation and the printing of
+        the elements added or updated within it. On exit, everything is
+        generated once and the damaged areas are printed with a single refresh.
+        Batches can be nested: only the outermost one prints.
+
+        Example:
+            with stack.batch():
+                for cell in cells:
+                    cell.update(attr={'text': ""})
+        """
+        self.begin_batch()
+        try:
+            yield self
+        finally:
+            self.end_batch()
+
+    def begin_batch(self):
+        """
+        Starts a batch (see Stack.batch), for when it cannot be a with block,
+        like a batch ended by a timer. Each call must be matched by one call
+        to Stack.end_batch.
+        """
+        self.batch_depth += 1
+
+    def end_batch(self):
+        """
+        Ends a batch started with Stack.begin_batch
+        """
+        self.batch_depth -= 1
+        if self.batch_depth == 0:
+            self._flush_batch()
+
+    def _defer_update(self, elt, print_it=True, displayed=None):
+        """
+        Registers an element updated during a batch
+
+        Args:
+            displayed tuple: the (fingerprint, area) of the element as it was
+                displayed before the update, None if it was not generated.
+                The previous area has to be cleaned if the element moves.
+        """
+        if elt in self.pending_updates:
+            # What is displayed is what was before the first update
+            previous_print_it, displayed = self.pending_updates[elt]
+            print_it = print_it or previous_print_it
+        self.pending_updates[elt] = (print_it, displayed)
+
+    def _flush_batch(self):
+        """
+        Generates the elements added or updated during the batch, then prints
+        all the damaged areas at once
+        """
+        pending_adds, self.pending_adds = self.pending_adds, {}
+        pending_updates, self.pending_updates = self.pending_updates, {}
+        areas = []
+        for elt in pending_adds:
+            elt.generator()
+            self.hit_index.insert(elt, elt.area)
+            areas.append(elt.area)
+        roots = {}
+        changed = []
+        for elt, (print_it, displayed) in pending_updates.items():
+            root = elt._get_root_layout()
+            if root is not None and root.needs_layout:
+                # Laid out again (once) below, which regenerates the element
+                roots[root] = True
+                continue
+            elt.generator()
+            self._reindex(elt)
+            if displayed is not None:
+                (fingerprint, previous_area) = displayed
+                is_unchanged = fingerprint is not None and \
+                               elt.fingerprint == fingerprint and \
+                               elt.area == previous_area
+                if is_unchanged:
+                    # Same image, at the same place, as the one displayed
+                    continue
+                areas.append(previous_area)
+            changed.append(elt)
+            if print_it:
+                areas.append(elt.area)
+        # Each layout whose size changed is laid out once, whatever the
+        # number of its children which were updated
+        for root in roots:
+            root.generator()
+            self._reindex(root)
+            areas.append(root.area)
+        # The others only need the new images pasted in their parents
+        for elt in changed:
+            elt._refresh_parents()
+        self.print_stack(areas=areas)
+
     def _click_handler(self, click_x, click_y):
         """
         Handles the click events from the device
         """
-        for elt in self.stack[::-1]:
-            if elt.area and coords_in_area(elt.area, click_x, click_y):
-                self._click_handler_to_elt(elt, (click_x, click_y))
-                break
+        elts = self.hit_index.query(click_x, click_y)
+        if elts:
+            topmost = max(elts, key=self.stack.key)
+            self._click_handler_to_elt(topmost, (click_x, click_y))
+
+    def _reindex(self, elt):
+        """
+        Reindexes the element's area for the click handler, if it is part of
+        the stack. To be called whenever the area of an element may have
+        changed.
+        """
+        if elt in self.hit_index:
+            self.hit_index.insert(elt, elt.area)
 
     def _click_handler_to_elt(self, elt, coords):
         """
@@ -82,10 +477,14 @@ class Stack():
         click_x, click_y = coords
 
         def invert_back():
-            # Let's avoid printing something which may have been removed
-            # from the stack in the meantime
-            inv = elt.is_inverted
-            self.screen.print(elt.image, x, y, inverted=inv, fast_invertion=False)
+            if elt.is_inverted:
+                self.screen.print(elt.image, x, y, inverted=True,
+                                  fast_invertion=False)
+            else:
+                # Let's print what the buffer holds, to avoid printing
+                # something which may have been removed from the stack in
+                # the meantime
+                self._print_buffer_area(elt.area)
         
         if elt.onclick_invert:
             x, y = elt.area[0] 
@@ -0,0 +1,71 @@
+from .utils import coords_in_area
+
+DEFAULT_CELL_SIZE = 64      # In pixels
+
+
+class SpatialGrid():
+    """
+    A uniform grid which maps every cell of the screen to the elements whose
+    area overlaps it. Finding the elements under a point then only requires
+    looking at a single cell instead of scanning every element.
+
+    Args:
+        cell_size int: the width and height of a cell, in pixels
+    """
+    def __init__(self, cell_size=DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self.cells = {}         # Shape {(col, row): set of elts}
+        self.areas = {}         # Shape {elt: indexed area}
+
+    def __contains__(self, elt):
+        return elt in self.areas
+
+    def __len__(self):
+        return len(self.areas)
+
+    def insert(self, elt, area):
+        """
+        Indexes the element with the given area. If it was already indexed,
+        it is moved.
+        """
+        if elt in self.areas:
+            if self.areas[elt] == area:
+                return
+            self.remove(elt)
+        self.areas[elt] = area
+        for cell in self._cells_of(area):
+            self.cells.setdefault(cell, set()).add(elt)
+
+    def remove(self, elt):
+        """
+        Removes the element from the index (does nothing if it is not indexed)
+        """
+        area = self.areas.pop(elt, None)
+        if area is None:
+            return
+        for cell in self._cells_of(area):
+            bucket = self.cells[cell]
+            bucket.discard(elt)
+            if not bucket:
+                del self.cells[cell]
+
+    def query(self, x, y):
+        """
+        Returns the elements whose area contains the given point (in no
+        particular order)
+        """
+        cell = (x // self.cell_size, y // self.cell_size)
+        bucket = self.cells.get(cell)
+        if not bucket:
+            return []
+        return [elt for elt in bucket if coords_in_area(self.areas[elt], x, y)]
+
+    def _cells_of(self, area):
+        """
+        Yields the coordinates of every cell the area overlaps
+        """
+        [(x, y), (w, h)] = area
+        size = self.cell_size
+        for col in range(x // size, (x+max(w, 1)-1) // size + 1):
+            for row in range(y // size, (y+max(h, 1)-1) // size + 1):
+                yield (col, row)
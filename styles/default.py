@@ -32,9 +32,18 @@ DEFAULT = {
         'background_color': (255,255,255,255),
         **common
     },
+    'Grid' : {
+        'background_color': (255,255,255,255),
+        **common
+    },
+    'VirtualList' : {
+        'background_color': (255,255,255,255),
+        **common
+    },
     'Margin' : {**common},
     'Demo'   : {**common},
     'Static' : {**common},
+    'TiledImage' : {**common},
     'OSKButton':{
         'sides' : 'tblr',
         'background_color': (255,255,255,255),
@@ -1,3 +1,14 @@
+from collections import OrderedDict
+from functools import lru_cache
+from threading import Lock
+from PIL import Image, ImageDraw, ImageFont
+
+FONT_CACHE_SIZE = 32            # Number of (path, size) fonts kept loaded
+TEXT_SIZE_CACHE_SIZE = 1024     # Number of (font, text) extents kept
+
+# Only used to measure text
+measure_draw = ImageDraw.Draw(Image.new("L", (1, 1)))
+
 
 def coords_in_area(area, click_x, click_y):
     """
@@ -11,4 +22,245 @@ def coords_in_area(area, click_x, click_y):
     if click_x >= x and click_x < x+w and click_y >= y and click_y < y+h:
         return True
     else:
-        return False
\ No newline at end of file
+        return False
+
+def intersect_areas(area_a, area_b):
+    """
+    Returns the intersection of two areas, or None if they do not overlap
+    Args:
+        area_a (list): The first area (of shape : [(x, y), (w, h)])
+        area_b (list): The second area (of shape : [(x, y), (w, h)])
+    """
+    [(xa, ya), (wa, ha)] = area_a
+    [(xb, yb), (wb, hb)] = area_b
+    x0, y0 = max(xa, xb), max(ya, yb)
+    x1, y1 = min(xa+wa, xb+wb), min(ya+ha, yb+hb)
+    if x1 <= x0 or y1 <= y0:
+        return None
+    return [(x0, y0), (x1-x0, y1-y0)]
+
+
+def bounding_area(areas):
+    """
+    Returns the smallest area containing all the given areas
+    Args:
+        areas (list): A non-empty list of areas
+    """
+    x0 = min(area[0][0] for area in areas)
+    y0 = min(area[0][1] for area in areas)
+    x1 = max(area[0][0] + area[1][0] for area in areas)
+    y1 = max(area[0][1] + area[1][1] for area in areas)
+    return [(x0, y0), (x1-x0, y1-y0)]
+
+
+def merge_areas(areas):
+    """
+    Merges the overlapping areas of a list into their bounding area, so that no
+    pixel gets composited twice. Areas which do not overlap are kept apart.
+    Args:
+        areas (list): A list of areas
+    """
+    merged = []
+    for area in areas:
+        area = [tuple(area[0]), tuple(area[1])]
+        # Absorb every already merged area this one overlaps, until stable
+        overlapping = True
+        while overlapping:
+            overlapping = False
+            for other in merged:
+                if intersect_areas(area, other):
+                    merged.remove(other)
+                    area = bounding_area([area, other])
+                    overlapping = True
+                    break
+        merged.append(area)
+    return merged
+
+
+def convert_color(color, mode):
+    """
+    Converts an RGBA color (the one used by the styles) to the given image
+    mode. In "L" mode, the color is turned into its luminance and transparent
+    colors are blended with white, as it is the color of the screen.
+    Args:
+        color (tuple): The color (of shape : (r, g, b, a) or (r, g, b))
+        mode (str): The image mode ("RGBA" or "L")
+    """
+    if mode != "L" or not isinstance(color, tuple):
+        return color
+    (r, g, b) = color[:3]
+    alpha = color[3] if len(color) > 3 else 255
+    luminance = (r*299 + g*587 + b*114 + 500) // 1000
+    return (luminance*alpha + 255*(255-alpha) + 127) // 255
+
+
+def convert_image(img, mode):
+    """
+    Converts a PIL image (like a loaded picture) to the given image mode, if
+    the pipeline requires it. In "L" mode, transparent pixels are blended with
+    white.
+    Args:
+        img (PIL Image): The image to convert
+        mode (str): The image mode ("RGBA" or "L")
+    """
+    if mode != "L" or img.mode == "L":
+        return img
+    if img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info:
+        img = img.convert("RGBA")
+        background = Image.new("RGBA", img.size, color=(255, 255, 255, 255))
+        img = Image.alpha_composite(background, img)
+    return img.convert("L")
+
+
+@lru_cache(maxsize=FONT_CACHE_SIZE)
+def get_font(path, size):
+    """
+    Returns the truetype font of the given size. Each (path, size) font is
+    only read and parsed once.
+    Args:
+        path (str): The path to the font file
+        size (int): The font size
+    """
+    return ImageFont.truetype(path, size)
+
+
+@lru_cache(maxsize=TEXT_SIZE_CACHE_SIZE)
+def get_text_size(font, text):
+    """
+    Returns the (width, height) of the text written with the given font
+    Args:
+        font (ImageFont): The font (as returned by get_font)
+        text (str): The text
+    """
+    return measure_draw.textsize(text, font=font)
+
+
+def text_cache_info():
+    """
+    Returns the hits, misses and sizes of the font and text size caches
+    """
+    return {
+        'fonts': get_font.cache_info(),
+        'text_sizes': get_text_size.cache_info()
+    }
+
+
+class LRUCache():
+    """
+    A thread-safe Least Recently Used cache, bounded by the total size of its
+    values.
+    Args:
+        max_size (int): The maximum total size of the values
+        sizeof (function): Returns the size of a value. By default, each value
+            counts for 1: the cache is then bounded by its number of values.
+    """
+    def __init__(self, max_size, sizeof=None):
+        self.max_size = max_size
+        self.sizeof = sizeof if sizeof else lambda value: 1
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.values = OrderedDict()     # Shape {key: (value, size)}
+        self.lock = Lock()
+
+    def __contains__(self, key):
+        return key in self.values
+
+    def __len__(self):
+        return len(self.values)
+
+    def get(self, key, default=None):
+        """
+        Returns the value of the key (and marks it as recently used), or the
+        default if it is not cached
+        """
+        with self.lock:
+            if key not in self.values:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self.values.move_to_end(key)
+            return self.values[key][0]
+
+    def put(self, key, value):
+        """
+        Caches the value, then evicts the least recently used values until
+        the cache fits its maximum size again. A value bigger than the cache
+        itself is not cached.
+        """
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.values:
+                self.size -= self.values.pop(key)[1]
+            if size > self.max_size:
+                return
+            self.values[key] = (value, size)
+            self.size += size
+            while self.size > self.max_size:
+                _, (_, evicted_size) = self.values.popitem(last=False)
+                self.size -= evicted_size
+
+    def clear(self):
+        with self.lock:
+            self.values.clear()
+            self.size = 0
+
+
+def image_nbytes(img):
+    """
+    Returns the (approximate) memory used by the pixels of a PIL image
+    """
+    if img is None:
+        return 0
+    return img.width * img.height * len(img.getbands())
+
+
+class IdentityKey():
+    """
+    Part of a cache key standing for an object which cannot be hashed (or
+    compared cheaply), like a PIL image: equal only to the same object.
+    It holds a reference to the object, so that its id cannot be given to
+    another object while the key is in a cache. This also keeps the object
+    alive: such keys must not go to the caches shared by all the elements
+    (see has_identity_key).
+    """
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __hash__(self):
+        return id(self.value)
+
+    def __eq__(self, other):
+        return isinstance(other, IdentityKey) and other.value is self.value
+
+
+def freeze(value):
+    """
+    Returns a hashable version of the value, to be used as (part of) a cache
+    key: dicts and lists become tuples, PIL images (and other unhashable
+    objects) are identified by the object itself (see IdentityKey).
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, Image.Image):
+        return IdentityKey(value)
+    try:
+        hash(value)
+    except TypeError:
+        return IdentityKey(value)
+    return value
+
+
+def has_identity_key(key):
+    """
+    Returns True if the frozen key (see freeze) contains an IdentityKey
+    """
+    if isinstance(key, IdentityKey):
+        return True
+    if isinstance(key, tuple):
+        return any(has_identity_key(value) for value in key)
+    return False
@@ -0,0 +1,133 @@
+class ZOrder():
+    """
+    The elements of the stack, from the bottom to the top.
+
+    Each element is given a z key: membership, removal and reordering only
+    touch a dict. The ordered list is rebuilt lazily, the next time the
+    elements are iterated (which the compositor does anyway).
+    """
+    def __init__(self, elts=()):
+        self.keys = {}          # Shape {elt: z key}
+        self.top = 0            # Highest z key given so far
+        self.bottom = 0         # Lowest z key given so far
+        self.ordered = []       # Cache of the elements, bottom to top
+        self.is_ordered = True
+        for elt in elts:
+            self.append(elt)
+
+    def __contains__(self, elt):
+        return elt in self.keys
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __iter__(self):
+        return iter(self._get_ordered())
+
+    def __reversed__(self):
+        return reversed(self._get_ordered())
+
+    def __getitem__(self, index):
+        return self._get_ordered()[index]
+
+    def key(self, elt):
+        """
+        Returns the z key of the element: the higher, the closer to the top
+        """
+        return self.keys[elt]
+
+    def index(self, elt):
+        """
+        Returns the position of the element, from the bottom (0)
+        """
+        if elt not in self.keys:
+            raise ValueError("Element not in the stack")
+        return self._get_ordered().index(elt)
+
+    def append(self, elt):
+        """
+        Puts the element on top (moves it if it is already there)
+        """
+        if elt in self.keys:
+            self.raise_to_top(elt)
+            return
+        self.top += 1
+        self.keys[elt] = self.top
+        if self.is_ordered:
+            self.ordered.append(elt)
+
+    def remove(self, elt):
+        """
+        Removes the element. Raises a ValueError if it is not there.
+        """
+        if self.keys.pop(elt, None) is None:
+            raise ValueError("Element not in the stack")
+        self.is_ordered = False
+
+    def raise_to_top(self, elt):
+        """
+        Moves the element to the top
+        """
+        if elt not in self.keys:
+            raise ValueError("Element not in the stack")
+        if self.keys[elt] == self.top:
+            return
+        self.top += 1
+        self.keys[elt] = self.top
+        self.is_ordered = False
+
+    def lower(self, elt):
+        """
+        Moves the element to the bottom
+        """
+        if elt not in self.keys:
+            raise ValueError("Element not in the stack")
+        self.bottom -= 1
+        self.keys[elt] = self.bottom
+        self.is_ordered = False
+
+    def insert_at(self, elt, index):
+        """
+        Inserts (or moves) the element at the given position, from the bottom
+        (0). The other elements keep their order.
+        """
+        if elt in self.keys:
+            del self.keys[elt]
+            self.is_ordered = False
+        ordered = self._get_ordered()
+        if index >= len(ordered):
+            self.append(elt)
+            return
+        if index <= 0:
+            self.keys[elt] = self.bottom = self.bottom - 1
+        else:
+            # Halfway between its new neighbours
+            below = self.keys[ordered[index-1]]
+            above = self.keys[ordered[index]]
+            key = (below + above) / 2
+            if key in (below, above):
+                # No room left between them: spread the keys again
+                self._renumber()
+                below = self.keys[ordered[index-1]]
+                above = self.keys[ordered[index]]
+                key = (below + above) / 2
+            self.keys[elt] = key
+        self.is_ordered = False
+
+    def _get_ordered(self):
+        """
+        Returns the list of the elements, bottom to top
+        """
+        if not self.is_ordered:
+            self.ordered = sorted(self.keys, key=self.keys.get)
+            self.is_ordered = True
+        return self.ordered
+
+    def _renumber(self):
+        """
+        Gives back integer z keys to the elements, keeping their order
+        """
+        ordered = self._get_ordered()
+        self.keys = {elt: z for z, elt in enumerate(ordered)}
+        self.bottom = 0
+        self.top = len(ordered) - 1